@@ -0,0 +1,94 @@
+"""
+Benchmarks chunk_message (the message splitter used by send_message) on
+synthetic message content.
+
+Usage: python benchmarks/chunk_message.py [--sizes 10000 100000 1000000] ...
+
+For each shape of content (many short lines, long paragraphs, unbroken text)
+and size, the time to chunk the content and the number of chunks are reported.
+Every chunk is checked against the length limit
+"""
+import argparse
+import os
+import random
+import string
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from beymax.utils import chunk_message
+
+def words(n):
+    return [
+        ''.join(random.choices(string.ascii_lowercase, k=random.randint(1, 10)))
+        for i in range(n)
+    ]
+
+def transcript(size):
+    """
+    Short lines, like a story transcript
+    """
+    lines = []
+    length = 0
+    while length < size:
+        lines.append(' '.join(words(random.randint(1, 12))))
+        length += len(lines[-1]) + 1
+    return '\n'.join(lines)
+
+def paragraphs(size):
+    """
+    Long lines made of sentences, like a database dump
+    """
+    lines = []
+    length = 0
+    while length < size:
+        lines.append('. '.join(' '.join(words(random.randint(5, 20))) for i in range(random.randint(20, 200))))
+        length += len(lines[-1]) + 1
+    return '\n'.join(lines)
+
+def unbroken(size):
+    """
+    No delimiters at all
+    """
+    return ''.join(random.choices(string.ascii_letters, k=size))
+
+SHAPES = {
+    'transcript': transcript,
+    'paragraphs': paragraphs,
+    'unbroken': unbroken,
+}
+
+def main():
+    parser = argparse.ArgumentParser('beymax-chunk-benchmark', description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--sizes', type=int, nargs='+', default=[10000, 100000, 1000000], help="Content sizes (characters) to benchmark")
+    parser.add_argument('--quote', default='```', help="Quote string to wrap each chunk in. Default: ```")
+    parser.add_argument('-n', '--iterations', type=int, default=5, help="Iterations of each size. Default: 5")
+    parser.add_argument('--seed', type=int, default=0, help="Random seed for the synthetic content")
+    args = parser.parse_args()
+    random.seed(args.seed)
+    header = '{:<12} {:>10} {:>8} {:>10} {:>10} {:>12}'
+    row = '{:<12} {:>10} {:>8} {:>10.3f} {:>10.3f} {:>12.1f}'
+    print(header.format('Shape', 'Size', 'Chunks', 'Best (ms)', 'Mean (ms)', 'MB/s'))
+    for shape, generate in SHAPES.items():
+        for size in args.sizes:
+            content = generate(size)
+            samples = []
+            for i in range(args.iterations):
+                start = time.perf_counter()
+                chunks = chunk_message(content, quote=args.quote)
+                samples.append(time.perf_counter() - start)
+            longest = max(len(chunk) for chunk in chunks)
+            if longest > 2000:
+                sys.exit("Chunk of {} characters exceeds the limit".format(longest))
+            print(row.format(
+                shape,
+                len(content),
+                len(chunks),
+                1000 * min(samples),
+                1000 * sum(samples) / len(samples),
+                len(content) / min(samples) / 1e6
+            ))
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,188 @@
+"""
+Benchmarks DBView and VolatileDBView operations against a synthetic database.
+
+Usage: python benchmarks/dbview.py [--provider sqlite] [--players 10000] ...
+
+The database is generated in a temporary directory, so this never touches the
+bot's real database. For each operation, the latency percentiles and the
+number of bytes written to storage are reported
+"""
+import argparse
+import asyncio
+import os
+import random
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+# Make sure the real database can't be found (or migrated) by the benchmark
+os.environ.pop('BEYMAX_FIXME_DB_PKL_PATH', None)
+
+from beymax.utils import DBView, VolatileDBView, configure_database
+
+def synthetic_players(n):
+    return {
+        100000000000000000 + i: {
+            'balance': random.randint(0, 500),
+            'intro_story': random.random() < 0.5,
+        }
+        for i in range(n)
+    }
+
+def synthetic_polls(n):
+    polls = {}
+    for i in range(n):
+        opts = ['Option {}'.format(j) for j in range(random.randint(2, 10))]
+        polls[200000000000000000 + i] = {
+            'header': "Someone has started a poll:\nPoll number {}".format(i),
+            'votes': {opt: random.randint(0, 20) for opt in opts},
+            'options': opts,
+            'participated': [300000000000000000 + j for j in range(random.randint(0, 20))],
+            'message': 200000000000000000 + i,
+            'channel': 400000000000000000,
+            'author': 300000000000000000,
+        }
+    return polls
+
+def synthetic_memecache(n):
+    return {
+        '{}:{}:{}'.format(random.randint(1, 100000), 'top text %d' % i, 'bottom text %d' % i): {
+            'url': 'https://i.imgflip.com/{:x}.jpg'.format(i),
+            'page': 'https://imgflip.com/i/{:x}'.format(i),
+        }
+        for i in range(n)
+    }
+
+def percentile(samples, pct):
+    """
+    Nearest-rank percentile of a sorted list
+    """
+    return samples[min(len(samples) - 1, int(len(samples) * pct / 100))]
+
+class Benchmark(object):
+    """
+    Collects latency samples and bytes written for each operation
+    """
+
+    def __init__(self):
+        self.results = []
+
+    async def measure(self, name, cls, iterations, operation):
+        stats = DBView.stats()
+        samples = []
+        for i in range(iterations):
+            start = time.perf_counter()
+            await operation(cls, i)
+            samples.append(time.perf_counter() - start)
+        await DBView.flush()
+        after = DBView.stats()
+        samples.sort()
+        self.results.append({
+            'operation': name,
+            'view': cls.__name__,
+            'n': iterations,
+            'p50': 1000 * percentile(samples, 50),
+            'p90': 1000 * percentile(samples, 90),
+            'p99': 1000 * percentile(samples, 99),
+            'max': 1000 * samples[-1],
+            'writes': after['flushes'] - stats['flushes'],
+            'bytes': after['bytes'] - stats['bytes'],
+        })
+
+    def report(self):
+        header = '{:<22} {:<15} {:>6} {:>9} {:>9} {:>9} {:>9} {:>7} {:>12}'
+        row = '{operation:<22} {view:<15} {n:>6} {p50:>9.3f} {p90:>9.3f} {p99:>9.3f} {max:>9.3f} {writes:>7} {bytes:>12}'
+        print(header.format('Operation', 'View', 'n', 'p50 (ms)', 'p90 (ms)', 'p99 (ms)', 'max (ms)', 'Writes', 'Bytes'))
+        for result in self.results:
+            print(row.format(**result))
+
+async def run(args):
+    players = synthetic_players(args.players)
+    player_ids = list(players)
+    polls = synthetic_polls(args.polls)
+    poll_ids = list(polls)
+    start = time.perf_counter()
+    await DBView.overwrite(
+        players=players,
+        polls=polls,
+        memecache=synthetic_memecache(args.memes),
+    )
+    await DBView.flush()
+    print("Generated synthetic database in {:.3f}s ({} bytes written)".format(
+        time.perf_counter() - start,
+        DBView.stats()['bytes']
+    ))
+
+    async def read_player(cls, i):
+        async with cls('players') as db:
+            db['players'][player_ids[i % len(player_ids)]]['balance']
+
+    async def update_player(cls, i):
+        async with cls('players') as db:
+            db['players'][player_ids[i % len(player_ids)]]['balance'] += 1
+
+    async def update_player_key(cls, i):
+        uid = player_ids[i % len(player_ids)]
+        async with cls(('players', uid)) as db:
+            db['players'][uid]['balance'] += 1
+
+    async def concurrent_updates(cls, i):
+        await asyncio.gather(*[
+            update_player_key(cls, i * 10 + j)
+            for j in range(10)
+        ])
+
+    async def update_poll(cls, i):
+        async with cls('polls') as db:
+            poll = db['polls'][poll_ids[i % len(poll_ids)]]
+            poll['votes'][poll['options'][0]] += 1
+
+    async def readonly_poll(cls, i):
+        DBView.readonly_view('polls', polls={})['polls'].get(poll_ids[i % len(poll_ids)])
+
+    async def serialize_memecache(cls, i):
+        DBView.serializable(DBView.readonly_view('memecache')['memecache'])
+
+    async def delete_scope(cls, i):
+        async with cls('benchmark_scratch') as db:
+            db['benchmark_scratch'] = {j: j for j in range(1000)}
+        async with cls('benchmark_scratch') as db:
+            await db.delete_scope('benchmark_scratch')
+
+    operations = [
+        ('read player', read_player, args.iterations),
+        ('update player', update_player, args.iterations),
+        ('update player key', update_player_key, args.iterations),
+        ('10 concurrent keys', concurrent_updates, max(1, args.iterations // 10)),
+        ('update poll', update_poll, args.iterations),
+        ('readonly_view', readonly_poll, args.iterations),
+        ('serializable', serialize_memecache, max(1, args.iterations // 10)),
+        ('delete_scope', delete_scope, max(1, args.iterations // 10)),
+    ]
+
+    benchmark = Benchmark()
+    for cls in (DBView, VolatileDBView):
+        for name, operation, iterations in operations:
+            await benchmark.measure(name, cls, iterations, operation)
+    benchmark.report()
+
+def main():
+    parser = argparse.ArgumentParser('beymax-dbview-benchmark', description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--provider', default='pickle', help="Database provider to benchmark. Default: pickle")
+    parser.add_argument('--write-behind', action='store_true', help="Enable write-behind mode")
+    parser.add_argument('--players', type=int, default=10000, help="Number of synthetic players. Default: 10000")
+    parser.add_argument('--polls', type=int, default=5000, help="Number of synthetic polls. Default: 5000")
+    parser.add_argument('--memes', type=int, default=20000, help="Number of synthetic memecache entries. Default: 20000")
+    parser.add_argument('-n', '--iterations', type=int, default=200, help="Iterations of each operation. Default: 200")
+    parser.add_argument('--seed', type=int, default=0, help="Random seed for the synthetic database")
+    args = parser.parse_args()
+    random.seed(args.seed)
+    with tempfile.TemporaryDirectory() as tempdir:
+        os.chdir(tempdir)
+        configure_database(args.provider, write_behind=args.write_behind)
+        asyncio.run(run(args))
+        os.chdir('/')
+
+if __name__ == '__main__':
+    main()
@@ -91,6 +91,7 @@ async def check_birthday(self):
                     "@here Today is %s's **%s** birthday!" % (
                         get_attr(self.get_user(uid), 'mention', 'Someone'),
                         postfix(str(today.year - data['year']))
-                    )
+                    ),
+                    priority='background'
                 )
                 db['birthdays'][uid]['notified'] = today.year
@@ -137,7 +137,7 @@ async def cmd_bet(self, message, amount, option):
     `$!bet <amount> <option>` : Places a bet on a gamba poll. Option can be an emoji numeral, a number, or the option's text
     Example: `$!bet 10 7` : Places 10 tokens on option 7
     """
-    async with DBView('gamba', 'players') as db:
+    async with DBView(('gamba', message.channel.id), ('players', message.author.id)) as db:
         if message.author.id not in db['players']:
             db['players'][message.author.id] = {
                 'balance':10
@@ -206,8 +206,9 @@ async def cmd_bet(self, message, amount, option):
             ),
             reference=existing.to_reference()
         )
-        await existing.edit(
-            content=format_poll(polldata)
+        self.update_live_message(
+            existing,
+            format_poll(polldata)
         )
 
 @Gamba.add_command('resolve', Arg('option', type=OptType, nargs='?', default='', help="The option to bet on. Can be an emoji, number, or the option's text. Defaults to the option with the most votes"))
@@ -309,8 +310,9 @@ async def cmd_resolve(self, message, option):
             reference=existing.to_reference()
         )
         polldata['winner'] = option
-        await existing.edit(
-            content=format_poll(polldata)
+        self.update_live_message(
+            existing,
+            format_poll(polldata)
         )
         # 4) cleanup
         del db['gamba'][message.channel.id]
@@ -54,7 +54,7 @@ class BeforeRound(FreePhase):
     async def on_leave(self, user):
         await super().on_leave(user)
         if user.id in self.game.refund:
-            async with DBView('players') as db:
+            async with DBView(('players', user.id)) as db:
                 if user.id not in db['players']:
                     db['players'][user.id] = {
                         'balance':10
@@ -112,7 +112,7 @@ class BeforeRound(FreePhase):
                     self.game.bets[user.id]
                 )
             )
-        async with DBView('players') as db:
+        async with DBView(('players', user.id)) as db:
             if user.id not in db['players']:
                 db['players'][user.id] = {
                     'balance':10
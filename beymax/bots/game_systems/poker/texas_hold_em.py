@@ -70,7 +70,7 @@ class BeforeRound(LockedPhase):
     # Phase locked as it's entirely a computational phase.
     # No input is handled, so it's unreasonable to expect users to leave
     async def before_phase(self):
-        async with DBView('players') as db:
+        async with DBView(('players', *[user.id for user in self.game.players])) as db:
             for user in self.game.players:
                 if user.id not in db['players']:
                     db['players'][user.id] = {
@@ -382,7 +382,7 @@ async def cmd_balance(self, message):
     """
     `$!balance` : Displays your current token balance
     """
-    async with DBView('players') as db:
+    async with DBView(('players', message.author.id)) as db:
         if message.author.id not in db['players']:
             db['players'][message.author.id] = {
                 'balance':10
@@ -406,7 +406,7 @@ async def cmd_payout(self, message, user, amount):
     `$!_payout <user> <amount>` : Pays tokens to the provided user
     Example: `$!_payout some_user_id 12`
     """
-    async with DBView('players') as db:
+    async with DBView(('players', user.id)) as db:
         if user.id not in db['players']:
             db['players'][user.id] = {
                 'balance':10
@@ -441,7 +441,7 @@ async def end_game(self, evt, hardness='soft'):
 
 @Games.subscribe('games_player_join')
 async def send_instructions(self, _, user, start):
-    db = DBView('players')
+    db = DBView(('players', user.id))
     key = 'intro_{}'.format(self._game_system.name)
     if user.id in db['players'] and key in db['players'][user.id] and db['players'][user.id][key]:
         await self.send_message(
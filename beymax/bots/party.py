@@ -31,6 +31,7 @@ async def cmd_party(self, message, name):
     Example: `$!party` or `!party Birthday`
     """
     if message.guild is not None:
+        replaced = [] # Scheduled cleanups of replaced parties
         async with DBView('parties', parties=[]) as db:
             for i in range(len(db['parties'])):
                 if message.guild.id == db['parties'][i]['guild'] and message.author.id == db['parties'][i]['creator'] and time.time()-db['parties'][i]['time'] < PARTY_DURATION:
@@ -87,6 +88,9 @@ async def cmd_party(self, message, name):
                             self.fetch_channel('dev'),
                             "Error deleting party channel for %s" % message.author.mention
                         )
+                    if 'cleanup' in db['parties'][i]:
+                        # The party is being replaced, so its scheduled cleanup is no longer needed
+                        replaced.append(db['parties'][i]['cleanup'])
                     db['parties'][i] = None
             db['parties'] = [party for party in db['parties'] if party is not None]
             name = (' '.join(name)+' Party') if len(name) > 0 else "{}'s Party".format(getname(message.author))
@@ -158,13 +162,18 @@ async def cmd_party(self, message, name):
                 'creator':message.author.id,
                 'reference_channel': message.channel.id,
                 'reference_message': message.id,
-                'time': time.time()
+                'time': time.time(),
             })
-            await self.dispatch_future(
+        # The future dispatch lock is taken after the parties lock is released
+        for dispatch_id in replaced:
+            await self.cancel_future(dispatch_id)
+        await update_parties({
+            channel.id: await self.dispatch_future(
                 PARTY_DURATION,
                 'cleanup-party',
                 partyID=channel.id,
             )
+        })
     else:
         await self.send_message(
             message.channel,
@@ -178,17 +187,19 @@ async def cmd_disband(self, message):
     `$!disband` : Closes any active party voice channels you have
     """
     if message.guild is not None:
-        pruned = False
         async with DBView('parties', parties=[]) as db:
-            for party in db['parties']:
-                if message.guild.id == party['guild'] and message.author.id == party['creator']:
-                    await kill_party(self, party)
-                    pruned = True
-            db['parties'] = [
-                party for party in db['parties']
-                if party is not None and party['creator'] != message.author.id
+            parties = [
+                dict(party) for party in db['parties']
+                if message.guild.id == party['guild'] and message.author.id == party['creator']
             ]
-        if not pruned:
+        cleanups = {}
+        for party in parties:
+            if 'cleanup' in party:
+                # The party is going away, so its scheduled cleanup is no longer needed
+                await self.cancel_future(party['cleanup'])
+            cleanups[party['id']] = await kill_party(self, party)
+        await update_parties(cleanups)
+        if not len(parties):
             await self.send_message(
                 message.channel,
                 "You don't have an active party"
@@ -202,15 +213,33 @@ async def prune_parties(self, _, partyID):
             if p['id'] == partyID:
                 party = p
                 break
-    if party is not None:
-        await kill_party(self, party)
+    await update_parties({
+        partyID: await kill_party(self, party, 'background') if party is not None else None
+    })
+
+async def update_parties(cleanups):
+    """
+    Takes a dictionary of party (channel) id -> scheduled cleanup id.
+    Parties with a cleanup of None are removed. The others are updated with
+    their new cleanup
+    """
+    if not len(cleanups):
+        return
     async with DBView('parties', parties=[]) as db:
         db['parties'] = [
-            p for p in db['parties']
-            if p is not None and p['id'] != partyID
+            party for party in db['parties']
+            if party is not None and cleanups.get(party['id'], True) is not None
         ]
+        for party in db['parties']:
+            if party['id'] in cleanups:
+                party['cleanup'] = cleanups[party['id']]
 
-async def kill_party(bot, party):
+async def kill_party(bot, party, priority='interactive'):
+    """
+    Deletes the party's channel, unless it is still in use.
+    Returns the id of the rescheduled cleanup if the channel is still in use,
+    otherwise None
+    """
     channel = discord.utils.get(
         bot.get_all_channels(),
         id=party['id'],
@@ -219,12 +248,11 @@ async def kill_party(bot, party):
     if channel is not None:
         if len(channel.members):
             # Rescheduler event, since channel is still active
-            await bot.dispatch_future(
+            return await bot.dispatch_future(
                 3600, # 1 hour,
                 'cleanup-party',
                 partyID=party['id']
             )
-            return
         name = (
             '`{}`'.format(party['name'])
             if str(party['name']) == str(channel.name)
@@ -244,16 +272,19 @@ async def kill_party(bot, party):
         if reference is not None:
             ref_message = await reference.fetch_message(party['reference_message'])
         if reference is not None and ref_message is not None:
-            await reference.send(
+            await bot.send_message(
+                reference,
                 "{} has been disbanded. If you would like to create another party, use the `$!party` command".format(
                     name
                 ),
-                reference=ref_message.to_reference()
+                reference=ref_message.to_reference(),
+                priority=priority
             )
         else:
-            await self.send_message(
-                self.fetch_channel('general'),
+            await bot.send_message(
+                bot.fetch_channel('general'),
                 "{} has been disbanded. If you would like to create another party, use the `$!party` command".format(
                     name
-                )
+                ),
+                priority=priority
             )
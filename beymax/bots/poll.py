@@ -63,7 +63,8 @@ async def cmd_poll(self, message, title, options):
         skip_debounce=True
     )
     for i in range(1,len(opts)+1):
-        await target.add_reaction(
+        await self.add_reaction(
+            target,
             keycap_emoji(i)
         )
     if not isinstance(message.channel, discord.abc.PrivateChannel):
@@ -104,29 +105,34 @@ async def on_poll_react(self, event, payload):
     emoji = payload.emoji
     polls = DBView.readonly_view('polls', polls={})['polls']
     if emoji.is_unicode_emoji() and payload.message_id in polls:
-        data = polls[payload.message_id]
-        channel = self.get_channel(data['channel'])
-        author = self.get_user(data['author'])
-        message = await channel.fetch_message(data['message'])
-        user = self.get_user(payload.user_id)
-        for reaction in message.reactions:
-            if reaction.emoji == payload.emoji.name:
-                await update_poll(self, event, author, message, reaction, user)
-
-
+        # Vote counts are refreshed once per burst of reactions
+        self.dispatch('poll-refresh', payload.message_id)
+        if payload.user_id != self.user.id and emoji.name in emoji_lookup:
+            async with DBView(('polls', payload.message_id)) as db:
+                data = db['polls'][payload.message_id]
+                if payload.user_id not in data['participated']:
+                    data['participated'].append(payload.user_id)
+                    await self.send_message(
+                        self.get_user(data['author']),
+                        getname(self.get_user(payload.user_id))+" has voted on your poll in "+self.get_channel(data['channel']).name
+                    )
 
-async def update_poll(self, event, author, message, reaction, user):
-    async with DBView('polls') as db:
-        if reaction.message.id in db['polls'] and (not reaction.custom_emoji) and reaction.emoji in emoji_lookup:
-            opt_index = emoji_lookup[reaction.emoji]
-            db['polls'][reaction.message.id]['votes'][db['polls'][reaction.message.id]['options'][opt_index]] = reaction.count - 1 # Beymax
-            data = db['polls'][reaction.message.id]
-            await message.edit(
-                content=format_poll(data)
-            )
-            if user.id not in data['participated']:
-                await self.send_message(
-                    author,
-                    getname(user)+" has voted on your poll in "+reaction.message.channel.name
-                )
-                db['polls'][reaction.message.id]['participated'].append(user.id)
+@Polls.subscribe('poll-refresh', coalesce=lambda self, event, message_id: message_id, window=2)
+async def refresh_poll(self, event, message_id):
+    """
+    Recounts the votes on a poll and updates the poll message
+    """
+    polls = DBView.readonly_view('polls', polls={})['polls']
+    if message_id not in polls:
+        return
+    channel = self.get_channel(polls[message_id]['channel'])
+    message = await channel.fetch_message(message_id)
+    async with DBView(('polls', message_id)) as db:
+        data = db['polls'][message_id]
+        for reaction in message.reactions:
+            if (not reaction.custom_emoji) and reaction.emoji in emoji_lookup and emoji_lookup[reaction.emoji] < len(data['options']):
+                data['votes'][data['options'][emoji_lookup[reaction.emoji]]] = reaction.count - 1 # Beymax
+        self.update_live_message(
+            message,
+            format_poll(data)
+        )
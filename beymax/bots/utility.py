@@ -5,6 +5,7 @@ from datetime import datetime, timedelta
 import json
 import discord
 import asyncio
+import time
 
 Utility = CommandSuite('Utilities')
 
@@ -27,13 +28,215 @@ async def cmd_task(self, message, task):
             "No such task"
         )
 
-@Utility.add_command('_nt')
-async def cmd_nt(self, message):
+@Utility.add_command('_tasks')
+async def cmd_tasks(self, message):
+    """
+    `$!_tasks` : Displays the schedule and run durations of each task
+    """
+    now = time.time()
+    body = []
+    for task, (interval, permanent) in sorted(self.tasks.items()):
+        stats = self.task_stats[task]
+        body.append(
+            "`{}`: every {}s{}, {}. {} runs, {} errors, {} timeouts, {} skipped".format(
+                task,
+                interval,
+                '' if interval == permanent else ' (temporarily, normally {}s)'.format(permanent),
+                'next run in {:.0f}s'.format(self.task_schedule[task] - now) if task in self.task_schedule else 'running',
+                stats.runs,
+                stats.errors,
+                stats.timeouts,
+                stats.skipped
+            )
+        )
+        if len(stats.durations):
+            body[-1] += ". Duration p50 {:.1f}ms, max {:.1f}ms".format(
+                1000 * stats.percentile(50),
+                1000 * max(stats.durations)
+            )
+    await self.send_message(
+        message.channel,
+        '\n'.join(body)
+    )
+
+@Utility.add_command('_nt', Arg('events', nargs='*', help='Optional list of events to report on'))
+async def cmd_nt(self, message, events):
+    """
+    `$!_nt [events...]` : Reports how many events have been dispatched, along with
+    event rates and handler timings for the busiest (or requested) events
+    """
+    if not len(events):
+        events = sorted(
+            self.metrics.events,
+            key=lambda event: self.metrics.events[event].dispatched,
+            reverse=True
+        )[:10]
+    body = ['%d events have been dispatched' % self.nt]
+    for event in events:
+        if event not in self.metrics.events:
+            body.append("`{}`: not dispatched to any listeners".format(event))
+            continue
+        stats = self.metrics[event]
+        body.append(
+            "`{}`: {} dispatched ({:.1f}/min), {} handled, {} errors".format(
+                event,
+                stats.dispatched,
+                self.metrics.rate(event),
+                stats.handled,
+                stats.errors
+            )
+        )
+        if len(stats.latencies):
+            body[-1] += ". Handler time p50 {:.1f}ms, p90 {:.1f}ms, p99 {:.1f}ms".format(
+                1000 * stats.percentile(50),
+                1000 * stats.percentile(90),
+                1000 * stats.percentile(99)
+            )
+    body.append('Recent events: {}'.format(', '.join(list(self.metrics.recent)[-20:])))
+    await self.send_message(
+        message.channel,
+        '\n'.join(body)
+    )
+
+@Utility.add_command('_queues')
+async def cmd_queues(self, message):
+    """
+    `$!_queues` : Displays event dispatch queue statistics
+    """
+    stats = self.scheduler.stats()
+    body = [
+        "{} event listeners are running, and {} are waiting".format(
+            stats['running'],
+            stats['waiting']
+        )
+    ]
+    busiest = sorted(
+        stats['events'].items(),
+        key=lambda item: item[1]['dispatched'],
+        reverse=True
+    )[:15]
+    for event, queue in busiest:
+        body.append(
+            "`{}` ({}): {dispatched} dispatched, {running} running, {waiting} waiting"
+            " (max {max_depth}), {delayed} delayed, {coalesced} coalesced, {dropped} dropped".format(
+                event,
+                queue['policy'],
+                **queue
+            )
+        )
+    await self.send_message(
+        message.channel,
+        '\n'.join(body)
+    )
+
+@Utility.add_command('_sends')
+async def cmd_sends(self, message):
+    """
+    `$!_sends` : Displays how long outbound requests have waited for Discord rate limits,
+    and how many live message edits have been saved
+    """
+    stats = self.send_scheduler.stats()
+    body = ["{} requests are waiting for rate limits".format(stats['waiting'])]
+    for priority, data in stats['priorities'].items():
+        body.append(
+            "{}: {} requests, {} delayed".format(
+                priority,
+                data['requests'],
+                data['delayed']
+            )
+        )
+        if data['max'] is not None:
+            body[-1] += ". Wait p50 {:.1f}ms, max {:.1f}ms".format(
+                1000 * data['p50'],
+                1000 * data['max']
+            )
+    live = self.live_messages
+    body.append(
+        "Live messages: {} edits, {} updates combined, {} unchanged updates skipped".format(
+            live.edits,
+            live.coalesced,
+            live.skipped
+        )
+    )
     await self.send_message(
         message.channel,
-        '%d events have been dispatched' % self.nt
+        '\n'.join(body)
     )
 
+@Utility.add_command('_handlers')
+async def cmd_handlers(self, message):
+    """
+    `$!_handlers` : Displays timings for the event handlers which have blocked the event loop the longest
+    """
+    handlers = sorted(
+        (stats for stats in self.metrics.handlers.values() if stats.runs > 0),
+        key=lambda stats: max(stats.blocking, default=0),
+        reverse=True
+    )[:10]
+    body = ["Handler durations are bucketed by {}s".format(
+        ', '.join('<{}'.format(bucket) for bucket in handlers[0].buckets) if len(handlers) else ''
+    )]
+    for stats in handlers:
+        durations = sorted(stats.durations)
+        body.append(
+            "`{}` ({}) on `{}`: {} runs, {} slow. Duration p50 {:.1f}ms, max {:.1f}ms."
+            " Longest block {:.1f}ms. Histogram: {}".format(
+                stats.handler,
+                stats.suite,
+                stats.event,
+                stats.runs,
+                stats.slow,
+                1000 * durations[len(durations) // 2],
+                1000 * durations[-1],
+                1000 * max(stats.blocking, default=0),
+                ' '.join(str(count) for count in stats.histogram())
+            )
+        )
+    await self.send_message(
+        message.channel,
+        '\n'.join(body)
+    )
+
+@Utility.add_command('_lag', Arg('stacks', type=int, nargs='?', default=1, help='Number of recent stall stacks to show'))
+async def cmd_lag(self, message, stacks):
+    """
+    `$!_lag [stacks]` : Displays event loop lag statistics and the stacks of recent stalls
+    """
+    monitor = self.lag_monitor
+    if not len(monitor.lags):
+        return await self.send_message(
+            message.channel,
+            "The lag monitor is not running"
+        )
+    body = [
+        "Event loop lag over the last {} samples: p50 {:.1f}ms, p99 {:.1f}ms, max {:.1f}ms".format(
+            len(monitor.lags),
+            1000 * monitor.percentile(50),
+            1000 * monitor.percentile(99),
+            1000 * max(monitor.lags)
+        ),
+        "{} recent stalls of {:.0f}ms or more".format(
+            len(monitor.stalls),
+            1000 * monitor.threshold
+        )
+    ]
+    for stall in list(monitor.stalls)[-10:]:
+        body.append("{}: {:.3f}s{}".format(
+            datetime.fromtimestamp(stall['time']).strftime('%m/%d/%Y - %H:%M:%S'),
+            stall['lag'],
+            '' if stall['stack'] is not None else ' (stack not captured)'
+        ))
+    await self.send_message(
+        message.channel,
+        '\n'.join(body)
+    )
+    for stall in [stall for stall in monitor.stalls if stall['stack'] is not None][-stacks:] if stacks > 0 else []:
+        await self.send_message(
+            message.channel,
+            stall['stack'],
+            quote='```'
+        )
+
 @Utility.add_command('_announce', Arg('destination', type=ChannelType(Utility, by_name=False, nullable=True), nargs='?', help="Direct output to specific channel (provide a channel mention)", default=None), Arg('content', remainder=True, help="Message to echo"))
 async def cmd_announce(self, message, destination, content):
     """
@@ -197,6 +400,27 @@ async def cmd_viewdb(self, message, scopes):
                 )
             )
 
+@Utility.add_command('_dbstats')
+async def cmd_dbstats(self, message):
+    """
+    `$!_dbstats` : Displays database write statistics
+    """
+    stats = DBView.stats()
+    await self.send_message(
+        message.channel,
+        "{flushes} database writes ({scopes} scopes, {bytes} bytes) have taken {time:.3f}s.\n"
+        "Average write: {avg:.2f}ms, Last write: {last:.2f}ms, Slowest write: {max:.2f}ms\n"
+        "{pending} scopes are waiting to be written. "
+        "{unchanged} scopes were skipped because they had not changed".format(
+            avg=(1000 * stats['time'] / stats['flushes']) if stats['flushes'] else 0,
+            **{
+                **stats,
+                'last': 1000 * stats['last'],
+                'max': 1000 * stats['max'],
+            }
+        )
+    )
+
 @Utility.add_command('_dropdb', Arg('scopes', help='List of DB scopes to delete', nargs='+', default=None))
 async def cmd_flushdb(self, message, scopes):
     """
@@ -1,13 +1,17 @@
-from ..utils import DBView, getname, Interpolator, standard_intents, TIMESTAMP_FORMAT
+from ..utils import DBView, getname, Interpolator, interpolate, standard_intents, TIMESTAMP_FORMAT, configure_database, chunk_message
 from ..args import Argspec
 from ..perms import PermissionsFile
 from .suite import CommandSuite
+from .events import EventRegistry, DispatchScheduler, EventMetrics, timed
+from .monitor import LagMonitor
+from .outbox import Outbox, SendScheduler, LiveMessages
+from .scheduler import Schedule, TaskStats
 import discord
 import asyncio
 import time
 import os
+import random
 import yaml
-from math import ceil
 import sys
 import shlex
 from functools import wraps, partial
@@ -30,20 +34,24 @@ class Client(discord.Client):
     """
     def __init__(self, *args, **kwargs):
         super().__init__(*args, intents=standard_intents(), **kwargs)
-        self.nt = 0
+        self.metrics = EventMetrics() # Dispatch counts and handler timings for each event
+        self._attaching_suite = None # Name of the CommandSuite currently being attached
         self.configuration = {}
         self.primary_guild = None
         self.channel_references = {} # reference name -> channel name/id
-        self.event_listeners = {} # event name -> [listener functions (self, event)]
+        self.events = EventRegistry() # event name -> listener functions (self, event)
         # changed to set in favor of event API
         self.event_preemption = {} # event name -> counter for preempting beymax-level events
         self.commands = {} # !cmd -> docstring. Functions take (self, message, content)
         self.ignored_users = set()
         self.tasks = {} # taskname (auto generated) -> (current exec interval, permanent exec interval)
+        self.task_schedule = Schedule() # taskname -> time of next execution
+        self.task_last_run = {} # taskname -> time of last execution
+        self.task_stats = {} # taskname -> TaskStats
+        self.task_checkpoint = (time.monotonic(), set()) # (time of last checkpoint, tasks run since then)
+        self.future_schedule = Schedule() # future dispatch id -> time of dispatch
         self.special = [] # list of (check, handler)
-        self._dbg_event_queue = []
-        self.debounced_channels = {}
-        self.channel_lock = asyncio.Lock()
+        self.interpolators = {} # channel id -> default Interpolator
         config_path = os.environ.get('BEYMAX_CONFIG_PATH', 'config.yml')
         if os.path.exists(config_path):
             with open(config_path) as reader:
@@ -51,6 +59,47 @@ class Client(discord.Client):
         else:
             self.configuration = {}
         self.command_prefix = self.config_get('prefix', default='!')
+        configure_database(
+            self.config_get('database', 'provider', default='pickle'),
+            self.config_get('database', 'path'),
+            write_behind=self.config_get('database', 'write_behind', default=False),
+            flush_interval=self.config_get('database', 'flush_interval', default=5),
+            flush_threshold=self.config_get('database', 'flush_threshold', default=16)
+        )
+        self.scheduler = DispatchScheduler(
+            concurrency=self.config_get('dispatch', 'max_concurrency', default=None),
+            limit=self.config_get('dispatch', 'event_concurrency', default=None),
+            size=self.config_get('dispatch', 'queue_size', default=1000),
+            policy=self.config_get('dispatch', 'policy', default='delay'),
+            overrides=self.config_get('dispatch', 'events', default={})
+        )
+        self.handler_tracing = self.config_get('tracing', 'enabled', default=True)
+        self.slow_handler_threshold = self.config_get('tracing', 'slow_handler', default=0.5)
+        self.outbox = Outbox(
+            self._bulk_send_message,
+            idle=self.config_get('outbound', 'idle', default=0.5),
+            flush_size=self.config_get('outbound', 'flush_size', default=2000)
+        )
+        self.send_scheduler = SendScheduler({
+            kind: (
+                self.config_get('outbound', 'rate_limits', kind, 'requests', default=requests),
+                self.config_get('outbound', 'rate_limits', kind, 'seconds', default=seconds)
+            )
+            for kind, requests, seconds in (
+                ('global', 50, 1),
+                ('send', 5, 5),
+                ('edit', 5, 5),
+                ('react', 1, 0.25),
+            )
+        })
+        self.live_messages = LiveMessages(
+            self.edit_message,
+            interval=self.config_get('outbound', 'live_edit_interval', default=2)
+        )
+        self.lag_monitor = LagMonitor(
+            threshold=self.config_get('lag_monitor', 'threshold', default=0.25),
+            interval=self.config_get('lag_monitor', 'interval', default=0.5)
+        )
 
         # Add the core api tasks and event subscriptions
         APIEssentials.attach(self)
@@ -158,11 +207,16 @@ class Client(discord.Client):
 
         return wrapper
 
-    def add_task(self, interval): #decorator. Sets the decorated function to run on the specified interval
+    def add_task(self, interval, *, timeout=None, overlap='skip', jitter=0): #decorator. Sets the decorated function to run on the specified interval
         """
         Decorator. Sets the decorated function to run on the specified interval.
         Arguments:
         interval : The interval in which to run the function, in seconds
+        timeout : Optional number of seconds the task may run before it is cancelled
+        overlap : What to do if the task is triggered (such as by $!_task) while it is still running.
+            "skip" (default): Ignore the new run. "queue": Run again once the current run finishes
+        jitter : Optional maximum number of seconds to randomly delay each run by.
+            Use this to keep tasks with the same interval from running at the same time
 
         The decorated function must be a coroutine (async def) and take only the bot object as an argument
         """
@@ -171,22 +225,60 @@ class Client(discord.Client):
             if taskname in self.tasks:
                 raise NameError("This task already exists! Change the name of the task function")
             self.tasks[taskname] = (interval, interval) # next, permanent
+            stats = self.task_stats[taskname] = TaskStats(timeout, overlap, jitter)
+            lock = asyncio.Lock()
 
             @self.subscribe(taskname)
             async def run_task(self, task):
-                # If the task set a temporary interval, check it here
-                if self.tasks[taskname][0] != self.tasks[taskname][1]:
-                    print("Task", taskname, "Reverting interval to", self.tasks[taskname][1])
-                    self.tasks[taskname] = (self.tasks[taskname][1], self.tasks[taskname][1])
-                # Run task
-                await func(self)
-                # Update last executed time (Used for restoring task intervals after shutdown)
-                async with DBView('tasks', tasks={'key': None, 'tasks': {}}) as db:
-                    db['tasks']['tasks'][taskname] = time.time()
+                if lock.locked() and stats.overlap == 'skip':
+                    print("Task", taskname, "is still running. Skipping")
+                    stats.skipped += 1
+                    return
+                async with lock:
+                    # If the task set a temporary interval, check it here
+                    if self.tasks[taskname][0] != self.tasks[taskname][1]:
+                        print("Task", taskname, "Reverting interval to", self.tasks[taskname][1])
+                        self.tasks[taskname] = (self.tasks[taskname][1], self.tasks[taskname][1])
+                    # The task is not rescheduled until it finishes
+                    self.task_schedule.cancel(taskname)
+                    start = time.monotonic()
+                    stats.runs += 1
+                    try:
+                        # Run task
+                        await asyncio.wait_for(func(self), stats.timeout)
+                    except asyncio.TimeoutError:
+                        # Timeouts count as a run, so that a stuck task is not immediately retried
+                        print("WARNING: Task", taskname, "timed out after", stats.timeout, "seconds")
+                        stats.timeouts += 1
+                    except:
+                        # Failed tasks are retried, as their last executed time was not updated
+                        stats.errors += 1
+                        self.task_schedule.schedule(taskname, time.time() + min(30, self.tasks[taskname][0]))
+                        raise
+                    finally:
+                        stats.durations.append(time.monotonic() - start)
+                    # Update last executed time. The task runner checkpoints this to the database
+                    # (Used for restoring task intervals after shutdown)
+                    self.task_last_run[taskname] = time.time()
+                    self.task_checkpoint[1].add(taskname)
+                    self._schedule_task(taskname)
 
             return run_task
         return wrapper
 
+    def _schedule_task(self, taskname):
+        """
+        Called internally. Schedules the next run of a task, based on its last run,
+        current interval, and jitter
+        """
+        stats = self.task_stats[taskname]
+        self.task_schedule.schedule(
+            taskname,
+            self.task_last_run.get(taskname, 0) + self.tasks[taskname][0] + (
+                random.uniform(0, stats.jitter) if stats.jitter else 0
+            )
+        )
+
     def update_interval(self, taskname, next_interval, permanent=True):
         if not taskname.startswith('task:'):
             taskname = 'task:{}'.format(taskname)
@@ -199,6 +291,9 @@ class Client(discord.Client):
             next_interval,
             next_interval if permanent else previous,
         )
+        if taskname in self.task_schedule:
+            # Reschedule the task, waking the task runner if it is now due sooner
+            self._schedule_task(taskname)
 
     def add_special(self, check): #decorator. Sets the decorated function to run whenever the check is true
         """
@@ -217,7 +312,7 @@ class Client(discord.Client):
         # NOTE: If exclusivity is not required, just use subscribe(after:message)
         def wrapper(func):
             event = 'special:{}'.format(func.__name__)
-            if event in self.event_listeners:
+            if event in self.events:
                 raise NameError("Special handler already defined")
             # Ugly lambda function: parse out and drop the event argument
             self.subscribe(event)(lambda s,e,*a,**k: func(s,*a,**k)) # If we add the condition we can double check
@@ -231,32 +326,41 @@ class Client(discord.Client):
         When can be a datetime object, timedelta object, or integer (interpreted as seconds in the future).
         Event should be the string name of an event to dispatch.
         Remaining arguments will be passed to the event handler on dispatch.
+        Returns an id which can be passed to cancel_future() to cancel the dispatch.
         Note: Arguments and keyword arguments must be serializable.
         To save discord objects, use DB serializers (planned)
         """
         if isinstance(when, int):
-            when = datetime.now() + timedelta(seconds=when)
+            when = time.time() + when
         elif isinstance(when, timedelta):
-            when = datetime.now() + when
-        elif not isinstance(when, datetime):
+            when = time.time() + when.total_seconds()
+        elif isinstance(when, datetime):
+            when = when.timestamp()
+        else:
             raise TypeError("When must be a datetime, timedelta, or int object, not {}".format(type(when)))
-        async with DBView('core_future_dispatch', core_future_dispatch=[]) as db:
-            db['core_future_dispatch'].append({
-                'date': when.strftime(TIMESTAMP_FORMAT),
+        async with DBView('core_future_dispatch', core_future_dispatch={'next': 0, 'events': {}}) as db:
+            migrate_future_dispatch(db)
+            dispatch_id = db['core_future_dispatch']['next']
+            db['core_future_dispatch']['next'] += 1
+            db['core_future_dispatch']['events'][dispatch_id] = {
+                'time': when,
                 'event': event,
                 'args': args,
                 'kwargs': kwargs
-            })
-        self.update_interval(
-            'check_future_dispatch',
-            # Update the next check_future_dispatch invocation to take place ASAP
-            # task runner will trigger in at most 30 seconds
-            # cfd will run and self-update its interval to best match the next dispatch
-            1,
-            False
-        )
-
+            }
+        # Wakes the future dispatcher, if this is now the next event due
+        self.future_schedule.schedule(dispatch_id, when)
+        return dispatch_id
 
+    async def cancel_future(self, dispatch_id):
+        """
+        Cancels an event scheduled by dispatch_future().
+        Returns False if the event was not scheduled (or has already been dispatched)
+        """
+        self.future_schedule.cancel(dispatch_id)
+        async with DBView('core_future_dispatch', core_future_dispatch={'next': 0, 'events': {}}) as db:
+            migrate_future_dispatch(db)
+            return db['core_future_dispatch']['events'].pop(dispatch_id, None) is not None
 
     def migration(self, key):
         """
@@ -275,7 +379,7 @@ class Client(discord.Client):
                         db['core_migrations'][key] = datetime.now().strftime(TIMESTAMP_FORMAT)
         return wrapper
 
-    def subscribe(self, event, *, condition=None, once=False): # decorator. Sets the decorated function to run on events
+    def subscribe(self, event, *, condition=None, once=False, coalesce=None, window=0): # decorator. Sets the decorated function to run on events
         """
         Decorator. Sets the decorated function to be run whenever the given event
         is dispatched.
@@ -283,6 +387,10 @@ class Client(discord.Client):
         event : A string argument name. WHen that argument is dispatched, the decorated function will run
         condition: Optional condition run with the same arguments as the event. If true, subscriber is run
         once: If true, subscriber will unsubscribe after running
+        coalesce: Optional function run with the same arguments as the event, which returns a key.
+            If the subscriber is already waiting to run for an event with the same key,
+            the new event is merged into it, and the subscriber runs once with the latest arguments
+        window: Number of seconds a coalesced subscriber waits for more events before running. Defaults to 0
 
         Note: If a condition is set and once is true, but the listener raises an exception, it will still unsubscribe
 
@@ -292,40 +400,64 @@ class Client(discord.Client):
         """
         # event functions should take the event, followed by expected arguments
         def wrapper(func):
-            if str(event) not in self.event_listeners:
-                self.event_listeners[str(event)] = []
+            pending = {} # coalesce key -> latest (args, kwargs)
+            stats = self.metrics.handler(self._attaching_suite, func.__name__, str(event))
 
             async def handle_event(*args, **kwargs):
                 try:
                     if condition is None or condition(*args, **kwargs):
                         if once:
-                            func.unsubscribe(event)
-                        return await func(*args, **kwargs)
+                            subscription.cancel()
+                            subscriptions = func.subscriptions.get(str(event), [])
+                            if subscription in subscriptions:
+                                subscriptions.remove(subscription)
+                                if not len(subscriptions):
+                                    del func.subscriptions[str(event)]
+                        if coalesce is not None:
+                            key = coalesce(*args, **kwargs)
+                            if key in pending:
+                                # Already waiting to run. Just update the arguments
+                                pending[key] = (args, kwargs)
+                                return
+                            pending[key] = (args, kwargs)
+                            try:
+                                await asyncio.sleep(window)
+                            finally:
+                                args, kwargs = pending.pop(key)
+                        timings = [0.0, 0.0] # total, longest time spent blocking the event loop
+                        start = time.monotonic()
+                        try:
+                            if self.handler_tracing:
+                                result = await timed(func(*args, **kwargs), timings)
+                            else:
+                                result = await func(*args, **kwargs)
+                        except:
+                            self._handler_finished(stats, time.monotonic() - start, timings, error=True)
+                            raise
+                        duration = time.monotonic() - start
+                        if self._handler_finished(stats, duration, timings):
+                            await self.trace(message=self._slow_handler_report(stats, duration, timings, args, kwargs))
+                        return result
                 except:
                     await self.trace()
                     raise
 
-            handle_event.orig = id(func)
-
-            self.event_listeners[str(event)].append(handle_event)
+            subscription = self.events.add(str(event), handle_event)
+            # func.subscriptions holds the Subscription handles for each event
+            # that this function is subscribed to.
             # func.unsubscribe will unsubscribe the function from the event
             # calling without args unsubscribes from the most recent event that this
             # function was subscribed to. An event can be specified to unsubscribe
             # from a specific event, if the function was subscribed to several
+            if not hasattr(func, 'subscriptions'):
+                func.subscriptions = {}
+            func.subscriptions.setdefault(str(event), []).append(subscription)
 
             def unsubscribe(evt=event):
-                if evt in self.event_listeners:
-                    for handler in self.event_listeners[evt]:
-                        if handler.orig == id(func):
-                            self.event_listeners[evt] = [
-                                hdl
-                                for hdl in self.event_listeners[evt]
-                                if hdl.orig != id(func)
-                            ]
-                            return
-                print("WARNING:", func, handle_event, "not subscribed to", evt)
-
-            # func.unsubscribe = lambda x=str(event):self.event_listeners[x].remove(handle_event)
+                subscriptions = func.subscriptions.pop(str(evt), [])
+                if not sum(sub.cancel() for sub in subscriptions):
+                    print("WARNING:", func, "not subscribed to", evt)
+
             func.unsubscribe = unsubscribe
             return func
         return wrapper
@@ -374,13 +506,22 @@ class Client(discord.Client):
             return command[len(self.command_prefix):]
         return command
 
-    def dispatch(self, event, *args, manual=False, **kwargs):
+    @property
+    def nt(self):
+        """
+        The total number of events which have been dispatched
+        """
+        return self.metrics.total
+
+    def dispatch(self, event, *args, manual=False, internal=False, **kwargs):
         """
         Manually dispatches an event (may be used to trigger tasks, commands, etc programatically).
         Arguments:
         event : The string event name to dispatch
         *args : Arguments to provide to the event handler
         manual : (Optional) If True, do not attempt to dispatch before: and after: events
+        internal : (Optional) If True, listeners are never dropped when the event's dispatch
+            queue is full. Used for tasks and future events, which would otherwise be lost
         **kwargs : Keyword arguments to provide to the event handler
 
         By default, when dispatch is called:
@@ -389,22 +530,25 @@ class Client(discord.Client):
         * Run any functions subscribed to the event
         * Run any functions subscribed to after:{event}
         """
-        self.nt += 1
         output = []
         if not manual:
-            while len(self._dbg_event_queue) >= 100:
-                self._dbg_event_queue.pop(0)
-            self._dbg_event_queue.append(event)
-            if 'before:'+str(event) in self.event_listeners:
-                output += self.dispatch_event('before:'+str(event), *args, **kwargs)
+            plan = self.events.plan(str(event))
+            self.metrics.dispatched(str(event), len(plan) > 0)
+            if not len(plan):
+                super().dispatch(event, *args, **kwargs)
+                return output
+            (before, before_listeners), (name, listeners), (after, after_listeners) = plan
+            if len(before_listeners):
+                output += self._run_listeners(before, before_listeners, args, kwargs, internal)
             super().dispatch(event, *args, **kwargs)
-            if str(event) in self.event_listeners:
-                output += self.dispatch_event(str(event), *args, **kwargs)
-            if 'after:'+str(event) in self.event_listeners:
-                output += self.dispatch_event('after:'+str(event), *args, **kwargs)
+            if len(listeners):
+                output += self._run_listeners(name, listeners, args, kwargs, internal)
+            if len(after_listeners):
+                output += self._run_listeners(after, after_listeners, args, kwargs, internal)
         else:
-            if str(event) in self.event_listeners:
-                output += self.dispatch_event(str(event), *args, **kwargs)
+            self.metrics.dispatched(str(event), str(event) in self.events)
+            if str(event) in self.events:
+                output += self._run_listeners(str(event), self.events[str(event)], args, kwargs, internal)
         return output
 
     def dispatch_event(self, event, *args, **kwargs):
@@ -412,13 +556,22 @@ class Client(discord.Client):
         Called internally. Sets the internal event loop to run event handlers for
         a given event
         """
+        return self._run_listeners(event, self.events[event], args, kwargs)
+
+    def _run_listeners(self, event, listeners, args, kwargs, internal=False):
+        """
+        Called internally. Schedules the given listeners for an event.
+        Listeners may be delayed or dropped if too many are running
+        (internal listeners are only delayed)
+        """
         if event in self.event_preemption and self.event_preemption[event] > 0:
             # If this event is currently being preempted, do not alert listeners
             return []
-        return [
-            asyncio.ensure_future(listener(self, event, *args, **kwargs), loop=self.loop)
-            for listener in self.event_listeners[event]
+        futures = [
+            self.scheduler.submit(event, listener, (self, event, *args), kwargs, self.loop, internal)
+            for listener in listeners
         ]
+        return [future for future in futures if future is not None]
 
 
 
@@ -440,15 +593,50 @@ class Client(discord.Client):
                 return default
         return obj
 
-    async def trace(self, send=True, channel=None):
+    def _handler_finished(self, stats, duration, timings, error=False):
+        """
+        Called internally. Records the timing of a subscribed handler.
+        Blocking time is only recorded if handler tracing is enabled.
+        Returns True if the handler blocked the event loop for too long
+        """
+        self.metrics.handled(stats.event, duration, error=error)
+        stats.runs += 1
+        stats.durations.append(duration)
+        if not self.handler_tracing:
+            return False
+        stats.blocking.append(timings[1])
+        if self.slow_handler_threshold is not None and timings[1] >= self.slow_handler_threshold:
+            stats.slow += 1
+            return not error # Errors are already traced
+        return False
+
+    def _slow_handler_report(self, stats, duration, timings, args, kwargs):
+        return (
+            "Slow handler {} ({}) for event {}: blocked the event loop for {:.3f}s"
+            " ({:.3f}s in total) over {:.3f}s\nArguments: {}"
+        ).format(
+            stats.handler,
+            stats.suite,
+            stats.event,
+            timings[1],
+            timings[0],
+            duration,
+            ', '.join([repr(arg) for arg in args[2:]] + ['{}={!r}'.format(k, v) for k,v in kwargs.items()])[:1000]
+        )
+
+    async def trace(self, send=True, channel=None, message=None):
         """
         Coroutine. Prints a stack trace to the console, and optionally sends it to the registered
         bugs channel
         Arguments:
         send : (Optional) If True (the default) post the stack trace to the bugs channel
+        message : (Optional) Report this message instead of a stack trace
         """
         x,y,z = sys.exc_info()
-        if x is None and y is None and z is None:
+        if message is not None:
+            msg = message
+            print(message)
+        elif x is None and y is None and z is None:
             msg = traceback.format_stack()
             traceback.print_stack()
             print("(Manual trace)")
@@ -463,20 +651,37 @@ class Client(discord.Client):
                 quote='```'
             )
 
+    async def report_lag(self, stall):
+        """
+        Coroutine. Called by the lag monitor when the event loop stalls.
+        If the watchdog captured the blocking code, its stack is reported to the dev channel
+        """
+        print("Event loop stalled for {:.3f}s".format(stall['lag']))
+        if stall['stack'] is not None:
+            await self.trace(message="Event loop stalled for {:.3f}s in:\n{}".format(
+                stall['lag'],
+                stall['stack']
+            ))
+
     async def shutdown(self):
         """
         Coroutine. Use this function for a clean shutdown.
-        Dispatches the 'cleanup' event, waits for all tasks to complete, then disconnects
-        the bot
+        Dispatches the 'cleanup' event, waits for all tasks to complete, sends any
+        pending messages and edits, writes any pending database changes, then disconnects the bot
         """
         await self.change_presence(status=discord.Status.offline)
+        self.lag_monitor.stop()
         tasks = self.dispatch('cleanup')
         if len(tasks):
             print("Waiting for ", len(tasks), "cleanup tasks to complete")
             await asyncio.wait(tasks)
+        await self.outbox.drain()
+        await self.live_messages.drain()
+        await self.checkpoint_tasks()
+        await DBView.flush()
         await self.close()
 
-    async def send_message(self, destination, content, *, delim='\n', quote='', interp=None, skip_debounce=False, **kwargs):
+    async def send_message(self, destination, content, *, delim='\n', quote='', interp=None, skip_debounce=False, priority='interactive', **kwargs):
         """
         Coroutine. Primary send-message function. Use to post a message to any channel.
         Arguments:
@@ -492,30 +697,32 @@ class Client(discord.Client):
                 Substitutions from both Interpolators are used, but the user provided one takes priority when they both substitute a string
             discord.Channel instance : Build a default Interpolator but for a channel other than the current destination
             dict instance : Substitute each occurence of a key in the dictionary with the associated value
-        skip_debounce : If set to True, send the message immediately without debouncing. By default, messages are debounced for 500ms
-            so that messages going to the same channel can be concatenated to avoid rapidly sending short messages
+        skip_debounce : If set to True, send the message immediately without debouncing. By default, messages are queued until
+            no new messages have been sent to the same channel for 500ms, so that they can be concatenated to avoid rapidly sending short messages
+        priority : "interactive" (default) or "background". When messages are being rate limited, interactive messages are sent first.
+            Use background for messages which are not replies to a user, such as scheduled announcements
         **kwargs : Additional keyword arguments to provide to the base class (discord.Client) send_message function.
 
         Setting quote or providing any kwargs will also disable message debouncing.
         """
         #built in chunking
-        if interp is None:
-            interp = Interpolator(self, destination)
-        elif interp is False:
+        if interp is False:
+            interp = {}
+        elif '$' not in content and (interp is None or isinstance(interp, (Interpolator, discord.abc.Messageable))):
+            # Interpolator substitutions all start with $, so there is nothing to substitute
             interp = {}
+        elif interp is None:
+            interp = self.interpolator(destination)
         elif isinstance(interp, Interpolator):
-            tmp = Interpolator(self, destination)
-            tmp.update(**interp)
-            interp = tmp
+            interp = {**self.interpolator(destination), **interp}
         elif isinstance(interp, discord.abc.Messageable):
-            interp = Interpolator(self, interp)
+            interp = self.interpolator(interp)
         elif not isinstance(interp, dict):
             raise TypeError("Cannot infer interpolation settings from an object of type "+type(interp))
         try:
             if '$EMOJIFY' in content:
                 content = emojize(content)
-            for key in interp:
-                content = content.replace(key, interp[key])
+            content = interpolate(content, interp)
         except:
             traceback.print_exc()
             print("Interpolation Error: ", {**interp})
@@ -525,72 +732,42 @@ class Client(discord.Client):
                 content,
                 delim=delim,
                 quote=quote,
+                priority=priority,
                 **kwargs
             )
         else:
-            self.dispatch('debounce-send', destination, content)
-            # return await self._debounced_send_message(
-            #     destination,
-            #     content
-            # )
+            self.outbox.put(destination, content, priority)
 
-    async def _bulk_send_message(self, destination, content, *, delim='\n', quote='', **kwargs):
+    def interpolator(self, channel):
+        """
+        Returns the default Interpolator for a channel (or user).
+        Interpolators are cached until the channel or Beymax's name changes, so do not modify the result
+        """
+        if channel.id not in self.interpolators:
+            self.interpolators[channel.id] = Interpolator(self, channel)
+        return self.interpolators[channel.id]
+
+    async def _bulk_send_message(self, destination, content, *, delim='\n', quote='', priority='interactive', **kwargs):
         """
         Sends a pre-interpolated message
-        Large messages are split according to the delimiter
+        Large messages are split according to the delimiter (see chunk_message)
         """
         if isinstance(destination, discord.User) and destination.bot:
             print("Aborting sending DM to a bot user")
             return None
-        body = content.split(delim)
-        tmp = []
         last_msg = None
-        for line in body:
-            tmp.append(line)
-            msg = delim.join(tmp)
-            if len(msg) > 2048 and delim=='. ':
-                # If the message is > 2KB and we're trying to split by sentences,
-                # try to split it up by spaces
-                last_msg = await self._bulk_send_message(
-                    destination,
-                    msg,
-                    delim=' ',
-                    interp=False,
-                    **kwargs
-                )
-            elif len(msg) > 1536 and delim=='\n':
-                # if the message is > 1.5KB and we're trying to split by lines,
-                # try to split by sentences
-                last_msg = await self._bulk_send_message(
-                    destination,
-                    msg,
-                    delim='. ',
-                    interp=False,
-                    **kwargs
-                )
-            elif len(msg) > 1024:
-                # Otherwise, send it if the current message has reached the
-                # 1KB chunking target
-                try:
-                    last_msg = await destination.send(
-                        quote+msg+quote,
-                        **kwargs
-                    )
-                except discord.errors.HTTPException as e:
-                    await self.trace()
-                tmp = []
-                await asyncio.sleep(1)
-        if len(tmp):
-            #send any leftovers (guaranteed <2KB)
+        for chunk in chunk_message(content, delim=delim, quote=quote):
+            await self.send_scheduler.acquire('send', destination.id, priority)
             try:
                 last_msg = await destination.send(
-                    quote+msg+quote
+                    chunk,
+                    **kwargs
                 )
             except discord.errors.HTTPException as e:
                 await self.trace()
         return last_msg
 
-    async def send_rich_message(self, destination, *, content=None, author=None, author_url=None, author_icon_url=None, title=None, description=None, colour=None, footer=None, image=None, thumbnail=None, __video=None, url=None, reference=None, mention_author=True):
+    async def send_rich_message(self, destination, *, content=None, author=None, author_url=None, author_icon_url=None, title=None, description=None, colour=None, footer=None, image=None, thumbnail=None, __video=None, url=None, reference=None, mention_author=True, priority='interactive'):
         """
         Coroutine. Send a message with rich content.
         Arguments:
@@ -609,6 +786,7 @@ class Client(discord.Client):
         thumbnail (optional): URL for thumbnail to display in the top right
         ~~video (optional): URL for video to embed~~
         url (optional): Large link to place in center of embed
+        priority (optional): "interactive" (default) or "background". See send_message()
         """
         if isinstance(author, Client):
             author = author.user
@@ -632,8 +810,32 @@ class Client(discord.Client):
             embed = embed.set_image(url=image)
         if thumbnail is not None:
             embed = embed.set_thumbnail(url=thumbnail)
+        await self.send_scheduler.acquire('send', destination.id, priority)
         return await destination.send(content=content, embed=embed, reference=reference, mention_author=mention_author)
 
+    async def edit_message(self, message, *, priority='interactive', **kwargs):
+        """
+        Coroutine. Edits a message, once the edit rate limit allows.
+        Keyword arguments are passed to message.edit()
+        """
+        await self.send_scheduler.acquire('edit', message.channel.id, priority)
+        return await message.edit(**kwargs)
+
+    def update_live_message(self, message, content):
+        """
+        Sets the content of a message which displays changing state, such as a poll.
+        Edits are skipped if the content is unchanged, and rapid updates are combined
+        so that the message is edited at most once every few seconds, always with the latest content.
+        Returns a future which completes once the message has been edited, or None if no edit was needed
+        """
+        return self.live_messages.update(message, content)
+
+    async def add_reaction(self, message, emoji, *, priority='interactive'):
+        """
+        Coroutine. Adds a reaction to a message, once the reaction rate limit allows
+        """
+        await self.send_scheduler.acquire('react', message.channel.id, priority)
+        return await message.add_reaction(emoji)
 
     def get_user(self, reference, *guilds):
         """
@@ -725,42 +927,71 @@ class Client(discord.Client):
 
     async def task_runner(self):
         """
-        Background worker to run tasks. At most every 30 seconds, while the bot is online,
-        check if it is time for any registered tasks to run
+        Background worker to run tasks. Sleeps until the next task is due to run,
+        or until a task is rescheduled. Tasks run in the background, so a slow task
+        never delays the others
         """
-        wait_time = 30
+        # db[tasks] holds the last executed time of each task, from before the last shutdown
+        taskdata = DBView.readonly_view('tasks', tasks={'tasks': {}})['tasks']['tasks']
+        for task in self.tasks:
+            self.task_last_run[task] = taskdata[task] if task in taskdata else 0
+            self._schedule_task(task)
+        checkpoint_interval = self.config_get('tasks', 'checkpoint_interval', default=300)
         while True:
-            if wait_time != 30:
-                print("Task runner using dynamic sleep of", wait_time)
-            await asyncio.sleep(max(0, wait_time))
-            wait_time = 30
-            # Check if it is time to run any tasks
-            #
-            current = time.time()
-            # db[tasks] is updated after each task is dispatched. Just get a r/o
-            # export to check times.
-            taskdata = DBView.readonly_view('tasks', tasks={'tasks': {}})['tasks']['tasks']
-            handles = []
-            for task, (interval, _) in self.tasks.items():
-                last = 0
-                if task in taskdata:
-                    last = taskdata[task]
-                if (current - last) >= interval:
-                    handles += self.dispatch(task)
-                    print("Dispatch", task)
-            start_wait = time.monotonic()
-            if len(handles):
-                await asyncio.wait(handles)
-            taskdata = DBView.readonly_view('tasks', tasks={'tasks': {}})['tasks']['tasks']
-            current = time.time()
-            # Wait the min of: time to get onto the next 30 second cycle, or time before next task scheduled
-            wait_time = ceil(min(
-                30 + start_wait - time.monotonic(),
-                *(
-                    (taskdata[task] if task in taskdata else 0) + interval - current
-                    for task, (interval, _) in self.tasks.items()
-                )
-            ))
+            if len(self.task_checkpoint[1]):
+                # Checkpoint if it has been a while, or if the runner is about to sleep for a while
+                # (no tasks are running, and none are due soon)
+                next_run = self.task_schedule.next()
+                if time.monotonic() - self.task_checkpoint[0] >= checkpoint_interval or (
+                    len(self.task_schedule) == len(self.tasks)
+                    and next_run - time.time() >= checkpoint_interval
+                ):
+                    await self.checkpoint_tasks()
+            for task in await self.task_schedule.wait():
+                self.dispatch(task, internal=True)
+                print("Dispatch", task)
+
+    async def checkpoint_tasks(self):
+        """
+        Coroutine. Writes the last executed time of any tasks which have run since
+        the previous checkpoint to the database
+        """
+        _, tasks = self.task_checkpoint
+        self.task_checkpoint = (time.monotonic(), set())
+        if len(tasks):
+            async with DBView('tasks', tasks={'key': None, 'tasks': {}}) as db:
+                for task in tasks:
+                    db['tasks']['tasks'][task] = self.task_last_run[task]
+
+    async def future_dispatcher(self):
+        """
+        Background worker to dispatch events scheduled by dispatch_future().
+        Sleeps until the next event is due, or until an event is scheduled
+        """
+        async with DBView('core_future_dispatch', core_future_dispatch={'next': 0, 'events': {}}) as db:
+            migrate_future_dispatch(db)
+            for dispatch_id, event in db['core_future_dispatch']['events'].items():
+                self.future_schedule.schedule(dispatch_id, event['time'])
+        while True:
+            due = await self.future_schedule.wait()
+            if not len(due):
+                continue
+            now = time.time()
+            async with DBView('core_future_dispatch', core_future_dispatch={'next': 0, 'events': {}}) as db:
+                for dispatch_id in due:
+                    event = db['core_future_dispatch']['events'].pop(dispatch_id, None)
+                    if event is None:
+                        # Cancelled while the database was locked
+                        continue
+                    overshoot = now - event['time']
+                    if overshoot > 1:
+                        print("WARNING: Future dispatch", event['event'], "overshot by", overshoot)
+                    self.dispatch(
+                        event['event'],
+                        *event['args'],
+                        internal=True,
+                        **event['kwargs']
+                    )
 
     async def on_guild_join(self, guild):
         """
@@ -821,63 +1052,60 @@ class Client(discord.Client):
 
 APIEssentials = CommandSuite('Beymax Core API Essentials')
 
-# Debounced messages are done through an event handler, so there must be a subscription
-# However, since this is a core feature, the subscription can't be added in a sub-bot
-@APIEssentials.subscribe('debounce-send')
-async def _debounced_send_message(self, evt, dest, content):
+@APIEssentials.subscribe('guild_channel_update')
+@APIEssentials.subscribe('guild_channel_delete')
+async def invalidate_channel_interpolator(self, event, channel, *args):
     """
-    Debounces outbound messages per-channel.
-    If any kwargs are provided, this sends immediately (no logical way to
-    concatenate the kwargs)
-    Waits 1s before sending a message, then
+    Drops the cached Interpolator of a renamed or deleted channel
     """
-    async with self.channel_lock:
-        if dest.id not in self.debounced_channels:
-            # print("DEBOUNCE: Starting new queue for", dest.id)
-            self.debounced_channels[dest.id] = content
-        else:
-            # print("DEBOUNCE: Appending to queue for", dest.id)
-            self.debounced_channels[dest.id]+='\n'+content
-        msg_len = len(self.debounced_channels[dest.id])
-    await asyncio.sleep(.5) # wait 500ms for other messages
-    async with self.channel_lock:
-        if msg_len == len(self.debounced_channels[dest.id]):
-            # No other messages were added to the queue while waiting
-            # print("DEBOUNCE: Finally sending", dest.id)
-            content = self.debounced_channels[dest.id]
-            del self.debounced_channels[dest.id]
-            await self._bulk_send_message(dest, content)
-
-# Future dispatch events are handled as a task
-# But tasks must be added to an existing bot
-@APIEssentials.add_task(30)
-async def check_future_dispatch(self):
-    now = datetime.now()
-    async with DBView('core_future_dispatch', core_future_dispatch=[]) as db:
-        for event in db['core_future_dispatch']:
-            target = datetime.strptime(event['date'], TIMESTAMP_FORMAT)
-            if target <= now:
-                overshoot = (now - target).total_seconds()
-                if overshoot > 1:
-                    print("WARNING: Future dispatch", event['event'], "overshot by", overshoot)
-                self.dispatch(
-                    event['event'],
-                    *event['args'],
-                    **event['kwargs']
-                )
-        db['core_future_dispatch'] = [
-            evt for evt in db['core_future_dispatch']
-            if datetime.strptime(evt['date'], TIMESTAMP_FORMAT) > now
-        ]
-        if len(db['core_future_dispatch']):
-            self.update_interval(
-                'check_future_dispatch',
-                min(
-                    ceil((datetime.strptime(event['date'], TIMESTAMP_FORMAT) - now).total_seconds())
-                    for evt in db['core_future_dispatch']
-                ),
-                False
-            )
+    self.interpolators.pop(channel.id, None)
+
+@APIEssentials.subscribe('member_update')
+@APIEssentials.subscribe('user_update')
+async def invalidate_interpolators(self, event, before, after):
+    """
+    Drops all cached Interpolators when Beymax's name or nickname changes,
+    or the Interpolator of a user's DMs when that user changes
+    """
+    if after.id == self.user.id:
+        self.interpolators.clear()
+    else:
+        self.interpolators.pop(after.id, None)
+
+def migrate_future_dispatch(db):
+    """
+    Converts the legacy list of future dispatch events (with formatted dates)
+    to the current format, keyed by id with epoch timestamps
+    """
+    if isinstance(db['core_future_dispatch'], list):
+        db['core_future_dispatch'] = {
+            'next': len(db['core_future_dispatch']),
+            'events': {
+                dispatch_id: {
+                    'time': datetime.strptime(event['date'], TIMESTAMP_FORMAT).timestamp(),
+                    'event': event['event'],
+                    'args': event['args'],
+                    'kwargs': event['kwargs'],
+                }
+                for dispatch_id, event in enumerate(db['core_future_dispatch'])
+            }
+        }
+
+@APIEssentials.add_task(300)
+async def compact_database(self):
+    """
+    Writes a fresh database snapshot once the journal (journal provider) grows
+    past the configured size
+    """
+    if await DBView.compact(self.config_get('database', 'compact_threshold', default=4194304)):
+        print("Compacted the database journal")
+
+@APIEssentials.subscribe('after:cleanup')
+async def flush_database(self, event):
+    """
+    Writes any pending database changes (write-behind mode) during cleanup
+    """
+    await DBView.flush()
 
 @APIEssentials.subscribe('ready', once=True)
 async def first_ready(self, event):
@@ -934,14 +1162,17 @@ async def first_ready(self, event):
                     print("Warning: Channel reference", name, "is not defined")
         self.permissions = await PermissionsFile.load(self, os.environ.get('BEYMAX_PERMISSIONS_PATH', 'permissions.yml'))
         asyncio.ensure_future(self.task_runner(), loop=self.loop)
+        asyncio.ensure_future(self.future_dispatcher(), loop=self.loop)
+        if self.config_get('lag_monitor', 'enabled', default=True):
+            self.lag_monitor.start(self.report_lag)
         print("Startup complete")
 
     except:
         traceback.print_exc()
         sys.exit("Unhandled exception during startup")
 
-@APIEssentials.subscribe('guild_role_create')
-@APIEssentials.subscribe('guild_role_delete')
+@APIEssentials.subscribe('guild_role_create', coalesce=lambda *args: 'roles', window=1)
+@APIEssentials.subscribe('guild_role_delete', coalesce=lambda *args: 'roles', window=1)
 @APIEssentials.subscribe('before:ready', once=True)
 async def update_ignore_roles(self, event, *args):
     """
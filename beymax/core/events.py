@@ -0,0 +1,423 @@
+import asyncio
+import time
+import types
+from bisect import bisect_left
+from collections import deque
+from functools import partial
+
+class Subscription(object):
+    """
+    Handle to a listener registered in an EventRegistry.
+    Call cancel() to unsubscribe the listener
+    """
+    __slots__ = ('registry', 'event', 'handler', 'active')
+
+    def __init__(self, registry, event, handler):
+        self.registry = registry
+        self.event = event
+        self.handler = handler
+        self.active = True
+
+    def cancel(self):
+        """
+        Unsubscribes the listener. Returns False if it was already unsubscribed
+        """
+        return self.registry.remove(self)
+
+    def __repr__(self):
+        return '<Subscription {} {}{}>'.format(
+            self.event,
+            self.handler,
+            '' if self.active else ' (cancelled)'
+        )
+
+class EventRegistry(object):
+    """
+    Stores event listeners for the Client.
+    Listeners are added and removed in constant time through Subscription handles.
+    For each dispatched event, the before:, main, and after: listeners are resolved
+    once into a plan, which is reused until the listeners of those events change.
+    Plans are only kept for events which have listeners, since arbitrary event
+    names (such as the dummy events of wait_for) are dispatched constantly
+    """
+
+    def __init__(self):
+        self.listeners = {} # event name -> {Subscription: None} (ordered)
+        self.plans = {} # dispatched event -> ((name, handlers), (name, handlers), (name, handlers))
+
+    def add(self, event, handler):
+        """
+        Subscribes the handler to the named event. Returns a Subscription
+        """
+        subscription = Subscription(self, event, handler)
+        if event not in self.listeners:
+            self.listeners[event] = {}
+        self.listeners[event][subscription] = None
+        self._invalidate(event)
+        return subscription
+
+    def remove(self, subscription):
+        """
+        Removes a Subscription. Returns False if it was not subscribed
+        """
+        if not subscription.active:
+            return False
+        subscription.active = False
+        listeners = self.listeners[subscription.event]
+        del listeners[subscription]
+        if not len(listeners):
+            del self.listeners[subscription.event]
+        self._invalidate(subscription.event)
+        return True
+
+    def _invalidate(self, event):
+        """
+        Called internally. Drops any plans which include listeners of this event
+        """
+        self.plans.pop(event, None)
+        for prefix in ('before:', 'after:'):
+            if event.startswith(prefix):
+                self.plans.pop(event[len(prefix):], None)
+
+    def plan(self, event):
+        """
+        Returns the (before:, main, after:) listeners for a dispatched event, as
+        (event name, tuple of handlers) pairs.
+        Returns an empty tuple if none of them have listeners
+        """
+        if event in self.plans:
+            return self.plans[event]
+        plan = tuple(
+            (name, self[name])
+            for name in ('before:' + event, event, 'after:' + event)
+        )
+        if not any(len(handlers) for name, handlers in plan):
+            return ()
+        self.plans[event] = plan
+        return plan
+
+    def __getitem__(self, event):
+        """
+        Returns a tuple of handlers subscribed to the event
+        """
+        if event in self.listeners:
+            return tuple(subscription.handler for subscription in self.listeners[event])
+        return ()
+
+    def __contains__(self, event):
+        return event in self.listeners
+
+class EventQueue(object):
+    """
+    Listener invocations of a single event which are waiting for the
+    DispatchScheduler, along with the event's dispatch statistics
+    """
+    __slots__ = (
+        'limit', 'size', 'policy', 'running', 'waiting',
+        'dispatched', 'dropped', 'coalesced', 'delayed', 'max_depth'
+    )
+
+    def __init__(self, limit, size, policy):
+        self.limit = limit
+        self.size = size
+        self.policy = policy
+        self.running = 0
+        self.waiting = deque() # [future, listener, args, kwargs, internal]
+        self.dispatched = 0
+        self.dropped = 0
+        self.coalesced = 0
+        self.delayed = 0
+        self.max_depth = 0
+
+class DispatchScheduler(object):
+    """
+    Limits how many event listeners may run at once, both for each event and in total.
+    Listeners which cannot run yet wait in a queue for their event.
+    When an event's queue is full, the event's overflow policy applies:
+    * "drop": The new invocation is discarded
+    * "coalesce": If an identical invocation (same listener and arguments) is waiting,
+      the new one is merged into it. Otherwise, the oldest waiting invocation is discarded
+    * "delay": The new invocation waits anyway. Nothing is lost, but the size is
+      not enforced, so the queue may grow without bound. Use "drop" or "coalesce"
+      for a bounded queue
+
+    Internal invocations (tasks and events scheduled by dispatch_future) would be
+    lost for good if they were discarded, so they always wait, regardless of the
+    policy. They count towards the queue's size, but are never discarded to make
+    room for other invocations
+
+    A limit of None means unlimited, which is the default. Listeners hold their
+    slot until they finish, including any time spent waiting for a user to reply
+    (see wait_for), so limits should only be set for events whose listeners finish
+    promptly
+    """
+
+    policies = {'drop', 'coalesce', 'delay'}
+
+    def __init__(self, concurrency=None, limit=None, size=1000, policy='delay', overrides=None):
+        if policy not in self.policies:
+            raise ValueError("Unknown dispatch overflow policy: {}".format(policy))
+        self.concurrency = concurrency
+        self.defaults = (limit, size, policy)
+        self.overrides = {} if overrides is None else overrides # event -> {limit, size, policy}
+        self.running = 0
+        self.queues = {} # event -> EventQueue
+        self.backlog = {} # events with waiting invocations (ordered)
+
+    def queue(self, event):
+        if event not in self.queues:
+            limit, size, policy = self.defaults
+            override = self.overrides.get(event, {})
+            policy = override.get('policy', policy)
+            if policy not in self.policies:
+                raise ValueError("Unknown dispatch overflow policy for {}: {}".format(event, policy))
+            self.queues[event] = EventQueue(
+                override.get('limit', limit),
+                override.get('size', size),
+                policy
+            )
+        return self.queues[event]
+
+    def submit(self, event, listener, args, kwargs, loop, internal=False):
+        """
+        Runs (or queues) a listener invocation. Returns a future for the result
+        of the listener, or None if the invocation was dropped.
+        If internal is True, the overflow policy does not apply to this invocation
+        """
+        queue = self.queue(event)
+        queue.dispatched += 1
+        if self._ready(queue) and not len(queue.waiting):
+            return self._start(queue, listener, args, kwargs, loop)
+        if len(queue.waiting) >= queue.size and not internal:
+            if queue.policy == 'drop':
+                queue.dropped += 1
+                return None
+            elif queue.policy == 'coalesce':
+                for item in queue.waiting:
+                    if item[1] is listener and item[2] == args and item[3] == kwargs:
+                        queue.coalesced += 1
+                        return item[0]
+                for item in queue.waiting:
+                    if not item[4]:
+                        # Discard the oldest invocation which is not internal
+                        queue.dropped += 1
+                        queue.waiting.remove(item)
+                        item[0].cancel()
+                        break
+                else:
+                    queue.dropped += 1
+                    return None
+        queue.delayed += 1
+        future = loop.create_future()
+        queue.waiting.append([future, listener, args, kwargs, internal])
+        queue.max_depth = max(queue.max_depth, len(queue.waiting))
+        self.backlog[event] = None
+        return future
+
+    def _ready(self, queue):
+        """
+        Called internally. Returns True if another listener of the queue's event may start
+        """
+        return (
+            (self.concurrency is None or self.running < self.concurrency)
+            and (queue.limit is None or queue.running < queue.limit)
+        )
+
+    def _start(self, queue, listener, args, kwargs, loop):
+        self.running += 1
+        queue.running += 1
+        task = asyncio.ensure_future(listener(*args, **kwargs), loop=loop)
+        task.add_done_callback(partial(self._finished, queue, loop))
+        return task
+
+    def _finished(self, queue, loop, task):
+        self.running -= 1
+        queue.running -= 1
+        self._pump(loop)
+
+    def _pump(self, loop):
+        """
+        Called internally. Starts waiting invocations while there is capacity
+        """
+        for event in list(self.backlog):
+            if self.concurrency is not None and self.running >= self.concurrency:
+                return
+            queue = self.queues[event]
+            while len(queue.waiting) and self._ready(queue):
+                future, listener, args, kwargs, internal = queue.waiting.popleft()
+                if future.cancelled():
+                    continue
+                task = self._start(queue, listener, args, kwargs, loop)
+                task.add_done_callback(partial(self._resolve, future))
+            if not len(queue.waiting):
+                del self.backlog[event]
+
+    @staticmethod
+    def _resolve(future, task):
+        """
+        Called internally. Passes the result of a delayed listener to its future
+        """
+        if future.cancelled():
+            return
+        if task.cancelled():
+            future.cancel()
+        elif task.exception() is not None:
+            future.set_exception(task.exception())
+        else:
+            future.set_result(task.result())
+
+    def stats(self):
+        """
+        Returns the number of running and waiting listeners,
+        and the dispatch statistics of each event
+        """
+        return {
+            'running': self.running,
+            'waiting': sum(len(self.queues[event].waiting) for event in self.backlog),
+            'events': {
+                event: {
+                    'running': queue.running,
+                    'waiting': len(queue.waiting),
+                    'max_depth': queue.max_depth,
+                    'dispatched': queue.dispatched,
+                    'delayed': queue.delayed,
+                    'coalesced': queue.coalesced,
+                    'dropped': queue.dropped,
+                    'policy': queue.policy,
+                }
+                for event, queue in self.queues.items()
+            }
+        }
+
+class EventStats(object):
+    """
+    Dispatch counters and handler timings for a single event
+    """
+    __slots__ = ('dispatched', 'handled', 'errors', 'time', 'latencies')
+
+    def __init__(self, samples):
+        self.dispatched = 0
+        self.handled = 0
+        self.errors = 0
+        self.time = 0.0
+        self.latencies = deque(maxlen=samples) # Most recent handler durations, in seconds
+
+    def percentile(self, pct):
+        """
+        Returns the given percentile of recent handler durations (seconds), or None
+        """
+        if not len(self.latencies):
+            return None
+        samples = sorted(self.latencies)
+        return samples[min(len(samples) - 1, int(len(samples) * pct / 100))]
+
+class EventMetrics(object):
+    """
+    Tracks recently dispatched events, and dispatch/handler statistics for each
+    event which has listeners
+    """
+
+    def __init__(self, history=100, samples=256):
+        self.started = time.monotonic()
+        self.total = 0
+        self.recent = deque(maxlen=history) # Most recently dispatched event names
+        self.samples = samples
+        self.events = {} # event name -> EventStats
+        self.handlers = {} # (suite, handler, event) -> HandlerStats
+
+    def __getitem__(self, event):
+        if event not in self.events:
+            self.events[event] = EventStats(self.samples)
+        return self.events[event]
+
+    def dispatched(self, event, listened=True):
+        """
+        Counts a dispatched event. Statistics are only kept if the event was listened to
+        """
+        self.total += 1
+        self.recent.append(event)
+        if listened:
+            self[event].dispatched += 1
+
+    def handled(self, event, duration, error=False):
+        """
+        Records a handler run. before: and after: handlers count towards the
+        event which was dispatched
+        """
+        for prefix in ('before:', 'after:'):
+            if event.startswith(prefix):
+                event = event[len(prefix):]
+                break
+        stats = self[event]
+        stats.handled += 1
+        stats.time += duration
+        stats.latencies.append(duration)
+        if error:
+            stats.errors += 1
+
+    def handler(self, suite, handler, event):
+        key = (suite, handler, event)
+        if key not in self.handlers:
+            self.handlers[key] = HandlerStats(suite, handler, event, self.samples)
+        return self.handlers[key]
+
+    def rate(self, event):
+        """
+        Returns the average number of times per minute the event has been dispatched
+        """
+        return 60 * self[event].dispatched / max(1, time.monotonic() - self.started)
+
+class HandlerStats(object):
+    """
+    Rolling timings for a single subscribed handler.
+    Duration is the time from start to finish, including time spent waiting.
+    Blocking time is the time the handler kept the event loop busy
+    """
+    __slots__ = ('suite', 'handler', 'event', 'runs', 'slow', 'durations', 'blocking')
+
+    buckets = (0.001, 0.005, 0.01, 0.05, 0.1, 0.5, 1, 5, 10)
+
+    def __init__(self, suite, handler, event, samples):
+        self.suite = suite
+        self.handler = handler
+        self.event = event
+        self.runs = 0
+        self.slow = 0
+        self.durations = deque(maxlen=samples)
+        self.blocking = deque(maxlen=samples) # Longest single step of each run
+
+    def histogram(self, samples=None):
+        """
+        Returns counts of recent samples (durations by default) falling under each bucket boundary.
+        The final count is for samples above the largest bucket
+        """
+        counts = [0] * (len(self.buckets) + 1)
+        for sample in (self.durations if samples is None else samples):
+            counts[bisect_left(self.buckets, sample)] += 1
+        return counts
+
+@types.coroutine
+def timed(coro, timings):
+    """
+    Drives a coroutine, like awaiting it directly, while recording how long each
+    step runs before yielding back to the event loop.
+    timings is a two-element list which receives the total and longest step times
+    """
+    send, value = coro.send, None
+    while True:
+        start = time.perf_counter()
+        try:
+            future = send(value)
+        except StopIteration as result:
+            return result.value
+        finally:
+            step = time.perf_counter() - start
+            timings[0] += step
+            timings[1] = max(timings[1], step)
+        try:
+            send, value = coro.send, (yield future)
+        except GeneratorExit:
+            coro.close()
+            raise
+        except BaseException as e:
+            send, value = coro.throw, e
@@ -0,0 +1,121 @@
+import asyncio
+import sys
+import threading
+import time
+import traceback
+from collections import deque
+
+class LagMonitor(object):
+    """
+    Measures how late the event loop is to run scheduled callbacks.
+    A sampler coroutine repeatedly sleeps for a fixed interval and records how much
+    longer than that it actually took. Meanwhile, a watchdog thread checks that the
+    sampler is still running. If the loop stalls, the watchdog captures the stack
+    of the event loop thread, so the blocking code can be found
+    """
+
+    def __init__(self, threshold=0.25, interval=0.5, history=20, samples=240):
+        self.threshold = threshold
+        self.interval = interval
+        self.lags = deque(maxlen=samples) # Recent scheduling delays, in seconds
+        self.stalls = deque(maxlen=history) # Recent stalls: {time, lag, stack}
+        self.heartbeat = None
+        self.captured = None # Heartbeat of the most recent stall captured by the watchdog
+        self.loop_thread = None
+        self.watchdog = None
+        self.stopping = None # Set to stop the watchdog thread
+        self.sampler = None
+        self.running = False
+        self.lock = threading.Lock() # Guards stalls and captured
+
+    def start(self, report=None):
+        """
+        Starts the sampler (on the running event loop) and the watchdog thread.
+        If provided, report is a coroutine function called with each stall.
+        Does nothing if the monitor (or the previous watchdog) is still running
+        """
+        if self.running or (self.watchdog is not None and self.watchdog.is_alive()):
+            return
+        self.running = True
+        self.loop_thread = threading.get_ident()
+        self.heartbeat = time.monotonic()
+        self.stopping = threading.Event()
+        self.watchdog = threading.Thread(target=self._watch, args=(self.stopping,), name='beymax-lag-watchdog', daemon=True)
+        self.watchdog.start()
+        self.sampler = asyncio.ensure_future(self._sample(report))
+        return self.sampler
+
+    def stop(self):
+        """
+        Stops the sampler, and waits for the watchdog thread to exit
+        """
+        self.running = False
+        if self.sampler is not None:
+            self.sampler.cancel()
+            self.sampler = None
+        if self.watchdog is not None:
+            self.stopping.set()
+            self.watchdog.join()
+
+    async def _sample(self, report):
+        loop = asyncio.get_running_loop()
+        while self.running:
+            start = loop.time()
+            await asyncio.sleep(self.interval)
+            lag = max(0, loop.time() - start - self.interval)
+            heartbeat = self.heartbeat
+            self.heartbeat = time.monotonic()
+            self.lags.append(lag)
+            if lag >= self.threshold:
+                with self.lock:
+                    if self.captured == heartbeat:
+                        # The watchdog caught this stall in progress
+                        stall = self.stalls[-1]
+                        stall['lag'] = lag
+                    else:
+                        # The stall ended before the watchdog noticed
+                        stall = {'time': time.time(), 'lag': lag, 'stack': None}
+                        self.stalls.append(stall)
+                if report is not None:
+                    # Report in the background, so that a slow report (such as a
+                    # message to Discord) does not hold up the heartbeat
+                    asyncio.ensure_future(self._report(report, stall))
+
+    async def _report(self, report, stall):
+        """
+        Called internally. Runs the report callback for a stall
+        """
+        try:
+            await report(stall)
+        except:
+            traceback.print_exc()
+
+    def _watch(self, stopping):
+        """
+        Called internally, on the watchdog thread
+        """
+        while not stopping.wait(self.threshold / 2):
+            heartbeat = self.heartbeat
+            if heartbeat != self.captured and time.monotonic() - heartbeat >= self.interval + self.threshold:
+                frame = sys._current_frames().get(self.loop_thread)
+                if frame is not None:
+                    stack = ''.join(traceback.format_stack(frame))
+                    with self.lock:
+                        if self.heartbeat != heartbeat:
+                            # The loop recovered while the stack was captured
+                            continue
+                        self.stalls.append({
+                            'time': time.time(),
+                            'lag': time.monotonic() - heartbeat - self.interval,
+                            'stack': stack,
+                        })
+                        self.captured = heartbeat
+
+    def percentile(self, pct):
+        """
+        Returns the given percentile of recent lag samples (seconds), or None
+        """
+        if not len(self.lags):
+            return None
+        samples = sorted(self.lags)
+        return samples[min(len(samples) - 1, int(len(samples) * pct / 100))]
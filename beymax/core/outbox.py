@@ -0,0 +1,281 @@
+import asyncio
+import heapq
+import itertools
+import time
+import traceback
+from collections import deque
+
+class TokenBucket(object):
+    """
+    Allows up to rate requests every per seconds. Tokens refill continuously
+    """
+    __slots__ = ('rate', 'per', 'tokens', 'updated')
+
+    def __init__(self, rate, per):
+        self.rate = rate
+        self.per = per
+        self.tokens = rate
+        self.updated = time.monotonic()
+
+    def delay(self, now):
+        """
+        Returns the number of seconds until a token is available
+        """
+        self.tokens = min(self.rate, self.tokens + (now - self.updated) * self.rate / self.per)
+        self.updated = now
+        return 0 if self.tokens >= 1 else (1 - self.tokens) * self.per / self.rate
+
+    def take(self):
+        self.tokens -= 1
+
+class SendScheduler(object):
+    """
+    Paces requests to Discord using token buckets, so that bursts go out as fast
+    as the rate limits allow, but no faster.
+    Each request has a route: the kind of request ("send", "edit", or "react") and
+    the channel it targets. Every route has its own bucket, and all requests share
+    a global bucket. When requests have to wait, interactive requests go before
+    background requests (such as scheduled announcements)
+    """
+
+    priorities = {'interactive': 0, 'background': 1}
+
+    def __init__(self, limits, samples=256):
+        self.limits = limits # request kind (or "global") -> (rate, per)
+        self.global_bucket = TokenBucket(*limits['global'])
+        self.buckets = {} # (kind, channel id) -> TokenBucket
+        self.waiting = [] # heap of (priority, sequence, kind, channel id, future)
+        self.sequence = itertools.count()
+        self.wake = asyncio.Event()
+        self.runner = None
+        self.requests = {priority: 0 for priority in self.priorities}
+        self.delayed = {priority: 0 for priority in self.priorities}
+        self.waits = {priority: deque(maxlen=samples) for priority in self.priorities} # Recent queue wait times, in seconds
+
+    def bucket(self, kind, target):
+        if (kind, target) not in self.buckets:
+            self.buckets[(kind, target)] = TokenBucket(*self.limits[kind])
+        return self.buckets[(kind, target)]
+
+    async def acquire(self, kind, target, priority='interactive'):
+        """
+        Coroutine. Waits until a request of the given kind may be made to the target channel (id)
+        """
+        if priority not in self.priorities:
+            raise ValueError("Unknown send priority: {}".format(priority))
+        self.requests[priority] += 1
+        now = time.monotonic()
+        bucket = self.bucket(kind, target)
+        if not len(self.waiting) and bucket.delay(now) <= 0 and self.global_bucket.delay(now) <= 0:
+            bucket.take()
+            self.global_bucket.take()
+            self.waits[priority].append(0)
+            return
+        self.delayed[priority] += 1
+        future = asyncio.get_running_loop().create_future()
+        heapq.heappush(self.waiting, (self.priorities[priority], next(self.sequence), kind, target, future))
+        self.wake.set()
+        if self.runner is None:
+            self.runner = asyncio.ensure_future(self._run())
+        await future
+        self.waits[priority].append(time.monotonic() - now)
+
+    async def _run(self):
+        """
+        Called internally. Releases waiting requests as tokens become available
+        """
+        try:
+            while len(self.waiting):
+                now = time.monotonic()
+                delay = None
+                blocked = set() # Routes with an earlier request still waiting
+                remaining = []
+                for entry in sorted(self.waiting):
+                    _, _, kind, target, future = entry
+                    if future.done():
+                        continue
+                    bucket = self.bucket(kind, target)
+                    wait = max(bucket.delay(now), self.global_bucket.delay(now))
+                    if wait <= 0 and (kind, target) not in blocked:
+                        bucket.take()
+                        self.global_bucket.take()
+                        future.set_result(None)
+                    else:
+                        blocked.add((kind, target))
+                        remaining.append(entry)
+                        if wait > 0:
+                            delay = wait if delay is None else min(delay, wait)
+                self.waiting = remaining # Sorted, so still a heap
+                if len(remaining):
+                    self.wake.clear()
+                    try:
+                        await asyncio.wait_for(self.wake.wait(), delay)
+                    except asyncio.TimeoutError:
+                        pass
+        finally:
+            self.runner = None
+
+    def stats(self):
+        """
+        Returns the number of waiting requests, and the requests and queue wait
+        times for each priority
+        """
+        return {
+            'waiting': len(self.waiting),
+            'priorities': {
+                priority: {
+                    'requests': self.requests[priority],
+                    'delayed': self.delayed[priority],
+                    'p50': sorted(self.waits[priority])[len(self.waits[priority]) // 2] if len(self.waits[priority]) else None,
+                    'max': max(self.waits[priority], default=None),
+                }
+                for priority in self.priorities
+            }
+        }
+
+class OutboundQueue(object):
+    """
+    Messages waiting to be sent to a single destination
+    """
+    __slots__ = ('destination', 'pending', 'size', 'priority', 'wake', 'flusher')
+
+    def __init__(self, destination):
+        self.destination = destination
+        self.pending = [] # message contents, joined with newlines when flushed
+        self.size = 0
+        self.priority = 'background' # the most urgent priority of the pending messages
+        self.wake = asyncio.Event()
+        self.flusher = None
+
+class Outbox(object):
+    """
+    Batches outbound messages for each destination.
+    Each destination with pending messages has one flusher task, which waits until
+    no new messages have arrived for the idle period (or enough content has built up),
+    then sends everything pending as one message
+    """
+
+    def __init__(self, send, idle=0.5, flush_size=2000):
+        self.send = send # coroutine function (destination, content, *, priority)
+        self.idle = idle
+        self.flush_size = flush_size
+        self.queues = {} # destination id -> OutboundQueue
+
+    def put(self, destination, content, priority='interactive'):
+        """
+        Adds a message to the destination's queue, starting its flusher if needed
+        """
+        if destination.id not in self.queues:
+            self.queues[destination.id] = OutboundQueue(destination)
+        queue = self.queues[destination.id]
+        queue.pending.append(content)
+        queue.size += len(content) + 1
+        queue.priority = min(queue.priority, priority, key=SendScheduler.priorities.__getitem__)
+        queue.wake.set()
+        if queue.flusher is None:
+            queue.flusher = asyncio.ensure_future(self._flush(queue))
+
+    async def _flush(self, queue):
+        """
+        Called internally. Flusher task for a destination.
+        Exits (and removes the queue) once nothing is pending
+        """
+        try:
+            while len(queue.pending):
+                while queue.size < self.flush_size:
+                    queue.wake.clear()
+                    try:
+                        await asyncio.wait_for(queue.wake.wait(), self.idle)
+                    except asyncio.TimeoutError:
+                        break
+                content = '\n'.join(queue.pending)
+                priority = queue.priority
+                queue.pending = []
+                queue.size = 0
+                queue.priority = 'background'
+                try:
+                    await self.send(queue.destination, content, priority=priority)
+                except:
+                    traceback.print_exc()
+        finally:
+            del self.queues[queue.destination.id]
+
+    async def drain(self):
+        """
+        Coroutine. Waits for all pending messages to be sent
+        """
+        while len(self.queues):
+            await asyncio.wait([queue.flusher for queue in self.queues.values()])
+
+class LiveMessages(object):
+    """
+    Keeps messages which display changing state (such as poll results) up to date.
+    Updates which would not change a message are skipped. Other updates are
+    coalesced, so that each message is edited at most once per interval, always
+    with its latest content
+    """
+
+    def __init__(self, edit, interval=2, history=1024):
+        self.edit = edit # coroutine function (message, *, content)
+        self.interval = interval
+        self.history = history
+        self.rendered = {} # message id -> (last content, time of last edit). Least recently edited first
+        self.pending = {} # message id -> [message, latest content, flusher]
+        self.edits = 0
+        self.skipped = 0
+        self.coalesced = 0
+
+    def update(self, message, content):
+        """
+        Sets the content that the message should display.
+        Returns a future which completes once the message has been edited, or None
+        if the message already displays the content
+        """
+        if message.id in self.pending:
+            self.coalesced += 1
+            self.pending[message.id][1] = content
+            return self.pending[message.id][2]
+        rendered, edited = self.rendered.get(message.id, (getattr(message, 'content', None), None))
+        if content == rendered:
+            self.skipped += 1
+            return None
+        self.pending[message.id] = [message, content, None]
+        self.pending[message.id][2] = asyncio.ensure_future(self._flush(message.id, edited))
+        return self.pending[message.id][2]
+
+    async def _flush(self, message_id, edited):
+        """
+        Called internally. Waits out the rest of the interval since the message's
+        last edit, then edits it with the latest content
+        """
+        if edited is not None and edited + self.interval > time.monotonic():
+            await asyncio.sleep(edited + self.interval - time.monotonic())
+        message, content, _ = self.pending.pop(message_id)
+        previous = self.rendered.pop(message_id, None)
+        if previous is not None and previous[0] == content:
+            # The state changed back while waiting
+            self.rendered[message_id] = previous
+            self.skipped += 1
+            return
+        # Recorded before editing, so that updates made during the edit compare
+        # against the content being sent
+        entry = self.rendered[message_id] = (content, time.monotonic())
+        if len(self.rendered) > self.history:
+            del self.rendered[next(iter(self.rendered))]
+        self.edits += 1
+        try:
+            await self.edit(message, content=content)
+        except:
+            traceback.print_exc()
+            # The message still displays its previous content
+            if self.rendered.get(message_id) is entry:
+                del self.rendered[message_id]
+                if previous is not None:
+                    self.rendered[message_id] = previous
+
+    async def drain(self):
+        """
+        Coroutine. Waits for all pending edits to be made
+        """
+        while len(self.pending):
+            await asyncio.wait([entry[2] for entry in self.pending.values()])
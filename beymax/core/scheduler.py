@@ -0,0 +1,123 @@
+import asyncio
+import heapq
+import itertools
+import time
+from collections import deque
+
+class Schedule(object):
+    """
+    Priority queue of keys, ordered by the time each key is next due.
+    Rescheduling or cancelling a key is O(log n): a new heap entry is pushed and
+    the outdated entry is skipped once it reaches the top of the heap
+    """
+
+    def __init__(self, clock=time.time):
+        self.clock = clock
+        self.heap = [] # (due time, sequence, key)
+        self.entries = {} # key -> (due time, sequence) of the current entry
+        self.sequence = itertools.count()
+        self.changed = asyncio.Event()
+
+    def schedule(self, key, when):
+        """
+        Sets the time that the key is due, replacing any previous time
+        """
+        entry = (when, next(self.sequence))
+        self.entries[key] = entry
+        heapq.heappush(self.heap, (*entry, key))
+        if len(self.heap) > 2 * len(self.entries) + 16:
+            # Too many outdated entries. Rebuild the heap
+            self.heap = [(*entry, key) for key, entry in self.entries.items()]
+            heapq.heapify(self.heap)
+        self.changed.set()
+
+    def cancel(self, key):
+        """
+        Removes the key from the schedule. Returns False if it was not scheduled
+        """
+        if key in self.entries:
+            del self.entries[key]
+            self.changed.set()
+            return True
+        return False
+
+    def _prune(self):
+        while len(self.heap) and self.entries.get(self.heap[0][2]) != self.heap[0][:2]:
+            heapq.heappop(self.heap)
+
+    def next(self):
+        """
+        Returns the earliest due time, or None if nothing is scheduled
+        """
+        self._prune()
+        return self.heap[0][0] if len(self.heap) else None
+
+    def pop_due(self, now=None):
+        """
+        Removes and returns the keys which are due, in order
+        """
+        now = self.clock() if now is None else now
+        due = []
+        while self.next() is not None and self.heap[0][0] <= now:
+            when, seq, key = heapq.heappop(self.heap)
+            del self.entries[key]
+            due.append(key)
+        return due
+
+    async def wait(self):
+        """
+        Coroutine. Sleeps until a key is due, or the schedule changes.
+        Returns the keys which are due
+        """
+        self.changed.clear()
+        when = self.next()
+        if when is None or when > self.clock():
+            try:
+                await asyncio.wait_for(
+                    self.changed.wait(),
+                    None if when is None else when - self.clock()
+                )
+            except asyncio.TimeoutError:
+                pass
+        return self.pop_due()
+
+    def __contains__(self, key):
+        return key in self.entries
+
+    def __len__(self):
+        return len(self.entries)
+
+    def __getitem__(self, key):
+        """
+        Returns the time the key is due
+        """
+        return self.entries[key][0]
+
+class TaskStats(object):
+    """
+    Options and run statistics for a single task
+    """
+    __slots__ = ('timeout', 'overlap', 'jitter', 'runs', 'errors', 'timeouts', 'skipped', 'durations')
+
+    policies = {'skip', 'queue'}
+
+    def __init__(self, timeout=None, overlap='skip', jitter=0, samples=64):
+        if overlap not in self.policies:
+            raise ValueError("Unknown task overlap policy: {}".format(overlap))
+        self.timeout = timeout
+        self.overlap = overlap
+        self.jitter = jitter
+        self.runs = 0
+        self.errors = 0
+        self.timeouts = 0
+        self.skipped = 0
+        self.durations = deque(maxlen=samples) # Most recent run durations, in seconds
+
+    def percentile(self, pct):
+        """
+        Returns the given percentile of recent run durations (seconds), or None
+        """
+        if not len(self.durations):
+            return None
+        samples = sorted(self.durations)
+        return samples[min(len(samples) - 1, int(len(samples) * pct / 100))]
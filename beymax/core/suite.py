@@ -26,6 +26,13 @@ class CommandSuite(object):
             )
         )
         self.bot = bot
+        bot._attaching_suite = self.name
+        try:
+            self._attach(bot)
+        finally:
+            bot._attaching_suite = None
+
+    def _attach(self, bot):
         for channel in self.channels:
             bot.reserve_channel(channel)
 
@@ -36,14 +43,16 @@ class CommandSuite(object):
             bot.subscribe(
                 subscription['event'],
                 condition=subscription['condition'],
-                once=subscription['once']
+                once=subscription['once'],
+                coalesce=subscription['coalesce'],
+                window=subscription['window']
             )(subscription['function'])
 
         for special in self.special:
             bot.add_special(special['checker'])(special['function'])
 
         for task in self.tasks:
-            bot.add_task(task['interval'])(task['function'])
+            bot.add_task(task['interval'], **task['options'])(task['function'])
 
         for command in self.commands:
             bot.add_command(command['command'], *command['args'], **command['kwargs'])(command['function'])
@@ -61,11 +70,16 @@ class CommandSuite(object):
             return func
         return wrapper
 
-    def add_task(self, interval):
+    def add_task(self, interval, *, timeout=None, overlap='skip', jitter=0):
         def wrapper(func):
             self.tasks.append(
                 {
                     'interval': interval,
+                    'options': {
+                        'timeout': timeout,
+                        'overlap': overlap,
+                        'jitter': jitter
+                    },
                     'function': func
                 }
             )
@@ -83,14 +97,16 @@ class CommandSuite(object):
             return func
         return wrapper
 
-    def subscribe(self, event, *, condition=None, once=False):
+    def subscribe(self, event, *, condition=None, once=False, coalesce=None, window=0):
         def wrapper(func):
             self.subscriptions.append(
                 {
                     'event': event,
                     'function': func,
                     'condition': condition,
-                    'once': once
+                    'once': once,
+                    'coalesce': coalesce,
+                    'window': window
                 }
             )
             return func
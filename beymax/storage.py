@@ -0,0 +1,361 @@
+import os
+import pickle
+import sqlite3
+import struct
+import zlib
+import threading
+from urllib.parse import quote, unquote
+
+class DatabaseProvider(object):
+    """
+    Base class for DBView storage providers.
+
+    Providers persist each database scope independently. Scope values are
+    handed to providers as opaque serialized payloads (bytes), so providers
+    never need to understand the contents of the database.
+    Providers must be safe to call from any thread
+    """
+
+    def load(self):
+        """
+        Returns a dictionary of every persisted scope -> payload
+        """
+        raise NotImplementedError()
+
+    def load_scope(self, scope):
+        """
+        Returns the persisted payload for a single scope.
+        Raises a KeyError if the scope has not been saved
+        """
+        raise NotImplementedError()
+
+    def save_scopes(self, payloads):
+        """
+        Persists the provided scope -> payload pairs.
+        Scopes not included are left untouched
+        """
+        raise NotImplementedError()
+
+    def delete_scope(self, scope):
+        """
+        Removes a scope from persistent storage, if present
+        """
+        raise NotImplementedError()
+
+    def close(self):
+        """
+        Releases any resources held by the provider
+        """
+        pass
+
+    def compact(self, threshold=0):
+        """
+        Compacts the storage, if the provider keeps a log which has grown
+        past threshold bytes. Returns True if compaction took place
+        """
+        return False
+
+class PickleProvider(DatabaseProvider):
+    """
+    Stores each scope as a pickle file within the {path}.d directory.
+    Files are replaced atomically, so a commit only rewrites the scopes it holds
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.directory = path + '.d'
+        # Older versions wrote the whole database to a single file. Recent versions
+        # accidentally used the name of the environment variable as the path, so that
+        # file holds the live data if it exists, and is checked first
+        self.legacy_paths = ['BEYMAX_FIXME_DB_PKL_PATH', path]
+        self.lock = threading.Lock()
+
+    def scope_path(self, scope, directory=None):
+        return os.path.join(
+            self.directory if directory is None else directory,
+            quote(scope, safe='') + '.pkl'
+        )
+
+    def _write(self, scope, payload, directory=None):
+        path = self.scope_path(scope, directory)
+        with open(path + '.tmp', 'wb') as w:
+            w.write(payload)
+            w.flush()
+            os.fsync(w.fileno())
+        os.replace(path + '.tmp', path)
+
+    def _migrate(self):
+        """
+        Splits the legacy single-file database (if any) into per-scope files
+        """
+        legacy = {}
+        for path in self.legacy_paths:
+            if os.path.isfile(path) and os.path.getsize(path) > 0:
+                print("Migrating legacy database", path, "to", self.directory)
+                with open(path, 'rb') as r:
+                    legacy = pickle.load(r)
+                break
+        # Populate a temporary directory first so an interrupted migration
+        # is simply repeated on the next startup
+        tmpdir = self.directory + '.tmp'
+        os.makedirs(tmpdir, exist_ok=True)
+        for scope, value in legacy.items():
+            self._write(scope, pickle.dumps(value), tmpdir)
+        os.replace(tmpdir, self.directory)
+        for path in self.legacy_paths:
+            if os.path.isfile(path):
+                print("Renaming legacy database", path, "to", path + '.migrated')
+                os.replace(path, path + '.migrated')
+
+    def load(self):
+        with self.lock:
+            if not os.path.isdir(self.directory):
+                self._migrate()
+            payloads = {}
+            for filename in os.listdir(self.directory):
+                if filename.endswith('.pkl'):
+                    with open(os.path.join(self.directory, filename), 'rb') as r:
+                        payloads[unquote(filename[:-4])] = r.read()
+            return payloads
+
+    def load_scope(self, scope):
+        path = self.scope_path(scope)
+        with self.lock:
+            if not os.path.isfile(path):
+                raise KeyError(scope)
+            with open(path, 'rb') as r:
+                return r.read()
+
+    def save_scopes(self, payloads):
+        with self.lock:
+            os.makedirs(self.directory, exist_ok=True)
+            for scope, payload in payloads.items():
+                self._write(scope, payload)
+
+    def delete_scope(self, scope):
+        path = self.scope_path(scope)
+        with self.lock:
+            if os.path.isfile(path):
+                os.remove(path)
+
+class SQLiteProvider(DatabaseProvider):
+    """
+    Stores each scope as a row in a SQLite database running in WAL mode.
+    Saving several scopes happens in a single transaction
+    """
+
+    def __init__(self, path, migrate_from=None):
+        self.path = path
+        self.lock = threading.Lock()
+        self.connection = sqlite3.connect(
+            path,
+            check_same_thread=False, # Access is serialized by self.lock
+            isolation_level=None # Transactions are managed explicitly
+        )
+        self.connection.execute('PRAGMA journal_mode=WAL')
+        self.connection.execute('PRAGMA synchronous=NORMAL')
+        created = self.connection.execute(
+            "SELECT name FROM sqlite_master WHERE type='table' AND name='scopes'"
+        ).fetchone() is None
+        self.connection.execute(
+            'CREATE TABLE IF NOT EXISTS scopes (scope TEXT PRIMARY KEY, data BLOB NOT NULL)'
+        )
+        if created and migrate_from is not None:
+            payloads = migrate_from.load()
+            if len(payloads):
+                print("Migrating", len(payloads), "scopes into", path)
+                self.save_scopes(payloads)
+
+    def load(self):
+        with self.lock:
+            return {
+                scope: data
+                for scope, data in self.connection.execute('SELECT scope, data FROM scopes')
+            }
+
+    def load_scope(self, scope):
+        with self.lock:
+            row = self.connection.execute(
+                'SELECT data FROM scopes WHERE scope = ?',
+                (scope,)
+            ).fetchone()
+        if row is None:
+            raise KeyError(scope)
+        return row[0]
+
+    def save_scopes(self, payloads):
+        with self.lock:
+            self.connection.execute('BEGIN')
+            try:
+                self.connection.executemany(
+                    'INSERT OR REPLACE INTO scopes (scope, data) VALUES (?, ?)',
+                    [(scope, sqlite3.Binary(payload)) for scope, payload in payloads.items()]
+                )
+            except:
+                self.connection.execute('ROLLBACK')
+                raise
+            self.connection.execute('COMMIT')
+
+    def delete_scope(self, scope):
+        with self.lock:
+            self.connection.execute('DELETE FROM scopes WHERE scope = ?', (scope,))
+
+    def close(self):
+        with self.lock:
+            self.connection.close()
+
+class JournalProvider(DatabaseProvider):
+    """
+    Appends each saved scope as a record in a journal file, instead of rewriting
+    the saved data. Every call to save_scopes is a single group of records,
+    which is checksummed and fsync'd once. A group which was only partially
+    written is discarded as a whole, so a commit is never half applied.
+    On startup, the database is rebuilt by replaying the journal over the
+    latest snapshot. compact() writes a fresh snapshot and empties the journal
+    """
+
+    # Groups are a 4-byte length and a 4-byte CRC32, followed by a pickled list
+    # of (scope, payload) records. A payload of None marks a deleted scope
+    header = struct.Struct('>II')
+
+    def __init__(self, path, migrate_from=None):
+        self.path = path
+        self.journal_path = path + '.journal'
+        self.lock = threading.Lock()
+        self.payloads = None # Latest payload of each scope
+        self.migrate_from = migrate_from
+        self.journal = None
+
+    def _write_snapshot(self, payloads):
+        with open(self.path + '.tmp', 'wb') as w:
+            pickle.dump(payloads, w)
+            w.flush()
+            os.fsync(w.fileno())
+        os.replace(self.path + '.tmp', self.path)
+
+    def _replay(self):
+        """
+        Called internally (with the lock held) to rebuild the database
+        from the snapshot and journal
+        """
+        if not (os.path.isfile(self.path) or os.path.isfile(self.journal_path)):
+            payloads = {} if self.migrate_from is None else self.migrate_from.load()
+            if len(payloads):
+                print("Migrating", len(payloads), "scopes into", self.path)
+            self._write_snapshot(payloads)
+        if os.path.isfile(self.path):
+            with open(self.path, 'rb') as r:
+                self.payloads = pickle.load(r)
+        else:
+            # No snapshot has been written since the journal was started
+            self.payloads = {}
+        offset = 0
+        if os.path.isfile(self.journal_path):
+            with open(self.journal_path, 'rb') as r:
+                data = r.read()
+            while offset + self.header.size <= len(data):
+                length, checksum = self.header.unpack_from(data, offset)
+                end = offset + self.header.size + length
+                if end > len(data):
+                    break
+                group = data[offset + self.header.size:end]
+                if zlib.crc32(group) != checksum:
+                    break
+                for scope, payload in pickle.loads(group):
+                    if payload is None:
+                        self.payloads.pop(scope, None)
+                    else:
+                        self.payloads[scope] = payload
+                offset = end
+            if offset < len(data):
+                # The last group was interrupted before it was fsync'd. Discard it
+                print("Discarding", len(data) - offset, "bytes of incomplete journal groups")
+        self.journal = open(self.journal_path, 'ab')
+        self.journal.truncate(offset)
+
+    def _append(self, records):
+        """
+        Called internally (with the lock held) to durably append a group of records
+        """
+        if self.payloads is None:
+            self._replay()
+        group = pickle.dumps(records)
+        self.journal.write(self.header.pack(len(group), zlib.crc32(group)) + group)
+        self.journal.flush()
+        os.fsync(self.journal.fileno())
+        for scope, payload in records:
+            if payload is None:
+                self.payloads.pop(scope, None)
+            else:
+                self.payloads[scope] = payload
+
+    def load(self):
+        with self.lock:
+            if self.payloads is None:
+                self._replay()
+            return dict(self.payloads)
+
+    def load_scope(self, scope):
+        with self.lock:
+            if self.payloads is None:
+                self._replay()
+            return self.payloads[scope]
+
+    def save_scopes(self, payloads):
+        with self.lock:
+            self._append(list(payloads.items()))
+
+    def delete_scope(self, scope):
+        with self.lock:
+            self._append([(scope, None)])
+
+    def journal_size(self):
+        return os.path.getsize(self.journal_path) if os.path.isfile(self.journal_path) else 0
+
+    def compact(self, threshold=0):
+        with self.lock:
+            if self.payloads is None:
+                self._replay()
+            if self.journal_size() == 0 or self.journal_size() < threshold:
+                return False
+            # If interrupted after the snapshot is replaced, replaying the
+            # old journal over the new snapshot has no effect
+            self._write_snapshot(self.payloads)
+            self.journal.truncate(0)
+            self.journal.flush()
+            os.fsync(self.journal.fileno())
+            return True
+
+    def close(self):
+        with self.lock:
+            if self.journal is not None:
+                self.journal.close()
+                self.journal = None
+                self.payloads = None
+
+PROVIDERS = {
+    'pickle': PickleProvider,
+    'sqlite': SQLiteProvider,
+    'journal': JournalProvider,
+}
+
+def get_provider(name='pickle', path=None, legacy_path='db.pkl'):
+    """
+    Builds a storage provider by name.
+    Non-pickle providers import the existing pickle database the first time
+    they are created
+    """
+    if name not in PROVIDERS:
+        raise NameError("No such database provider: {}".format(name))
+    if name == 'pickle':
+        return PickleProvider(legacy_path if path is None else path)
+    elif name == 'sqlite':
+        return SQLiteProvider(
+            'db.sqlite3' if path is None else path,
+            migrate_from=PickleProvider(legacy_path)
+        )
+    elif name == 'journal':
+        return JournalProvider(
+            'db.snapshot' if path is None else path,
+            migrate_from=PickleProvider(legacy_path)
+        )
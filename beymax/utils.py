@@ -6,16 +6,44 @@ import warnings
 import traceback
 import discord
 import json
+import atexit
+import time
+import hashlib
+import copy
+import io
+import re
+from concurrent.futures import ThreadPoolExecutor
+from functools import partial, lru_cache
+from collections.abc import Mapping, MutableMapping, Sequence
+from .storage import get_provider
 
 DATABASE = {
     'lock': asyncio.Lock(),
     'scope_locks': {},
-    'data': None
+    'data': None,
+    'provider': None,
+    'write_behind': None, # None, or (flush interval, flush threshold)
+    'pending': {}, # scope -> committed payload (None if deleted) awaiting write-behind
+    'flushing': {}, # scope -> payload currently being written
+    'writer': None,
+    'flush_event': None,
+    'executor': None, # Single thread which performs all blocking database work
+    'digests': {}, # scope -> digest of the last committed payload
+    'stats': {
+        'flushes': 0,
+        'scopes': 0,
+        'bytes': 0,
+        'time': 0.0,
+        'last': 0.0,
+        'max': 0.0,
+        'unchanged': 0, # scopes which were touched by a view, but did not need to be saved
+    }
 }
 
 TIMESTAMP_FORMAT = "%m/%d/%Y - %H:%M:%S"
 
-# Move this to the database provider settings when that change is made
+# Default location of the pickle database, and the source used when migrating
+# to another provider. Set the database provider in config.yml
 DB_PATH = os.environ.get('BEYMAX_FIXME_DB_PKL_PATH', 'db.pkl')
 
 # def parse_id_keys(obj):
@@ -44,43 +72,414 @@ class Defaultable(object):
     """
     pass
 
-class FrozenList(list):
+def freeze(scope, value):
+    """
+    Returns a read-only proxy of the given value, if it is a dict or list
+    """
+    if isinstance(value, dict):
+        return FrozenDict(scope, value)
+    elif isinstance(value, list):
+        return FrozenList(scope, value)
+    return value
+
+class FrozenList(Sequence):
+    """
+    Read-only proxy to a list in the database.
+    Nothing is copied. Nested dicts and lists are wrapped as they are accessed
+    """
+    __slots__ = ('_scope', '_data')
+
     def __init__(self, scope, data):
-        super().__init__([
-            FrozenDict(scope, value) if isinstance(value, dict) else (
-                FrozenList(scope, value) if isinstance(value, list) else value
-            )
-            for value in data
-        ])
         self._scope = scope
+        self._data = data._data if isinstance(data, FrozenList) else data
+
+    def __getitem__(self, idx):
+        if isinstance(idx, slice):
+            return FrozenList(self._scope, self._data[idx])
+        return freeze(self._scope, self._data[idx])
 
     def __setitem__(self, idx, value):
         raise TypeError("Read-Only access to this scope: {}".format(self._scope))
 
-class FrozenDict(dict):
+    def __delitem__(self, idx):
+        raise TypeError("Read-Only access to this scope: {}".format(self._scope))
+
+    def __len__(self):
+        return len(self._data)
+
+    def __iter__(self):
+        for value in self._data:
+            yield freeze(self._scope, value)
+
+    def __contains__(self, value):
+        return value in self._data
+
+    def __eq__(self, other):
+        return self._data == (other._data if isinstance(other, FrozenList) else other)
+
+    def __repr__(self):
+        return repr(self._data)
+
+    def __reduce__(self):
+        # Frozen values which end up in a mutable scope are saved as plain lists
+        return (list, (self._data,))
+
+class FrozenDict(Mapping):
+    """
+    Read-only proxy to a dict in the database.
+    Nothing is copied. Nested dicts and lists are wrapped as they are accessed
+    """
+    __slots__ = ('_scope', '_data')
+
     def __init__(self, scope, data):
-        super().__init__({
-            key: FrozenDict(scope, value) if isinstance(value, dict) else (
-                FrozenList(scope, value) if isinstance(value, list) else value
-            )
-            for key, value in data.items()
-        })
         self._scope = scope
+        self._data = data._data if isinstance(data, FrozenDict) else data
+
+    def __getitem__(self, key):
+        return freeze(self._scope, self._data[key])
 
     def __setitem__(self, key, value):
         raise TypeError("Read-Only access to this scope: {}".format(self._scope))
 
+    def __delitem__(self, key):
+        raise TypeError("Read-Only access to this scope: {}".format(self._scope))
+
+    def __len__(self):
+        return len(self._data)
+
+    def __iter__(self):
+        return iter(self._data)
+
+    def __contains__(self, key):
+        return key in self._data
+
+    def __eq__(self, other):
+        return self._data == (other._data if isinstance(other, FrozenDict) else other)
+
+    def __repr__(self):
+        return repr(self._data)
+
+    def __reduce__(self):
+        # Frozen values which end up in a mutable scope are saved as plain dicts
+        return (dict, (self._data,))
+
+class ScopeLock(object):
+    """
+    Guards a single database scope.
+    Views which hold the whole scope lock it exclusively. Views which only hold
+    keys within the scope share it with each other, and then lock their keys
+    individually. Exclusive waiters take priority over new shared holders
+    """
+
+    def __init__(self):
+        self.condition = asyncio.Condition()
+        self.shared = 0
+        self.exclusive = False
+        self.waiting = 0 # Exclusive waiters
+        self.keys = {} # key -> asyncio.Lock
+
+    async def acquire(self, shared=False):
+        async with self.condition:
+            if shared:
+                await self.condition.wait_for(lambda: not (self.exclusive or self.waiting))
+                self.shared += 1
+            else:
+                self.waiting += 1
+                try:
+                    await self.condition.wait_for(lambda: not (self.exclusive or self.shared))
+                finally:
+                    self.waiting -= 1
+                self.exclusive = True
+
+    async def release(self, shared=False):
+        async with self.condition:
+            if shared:
+                self.shared -= 1
+            else:
+                self.exclusive = False
+            self.condition.notify_all()
+
+    def key_lock(self, key):
+        if key not in self.keys:
+            self.keys[key] = asyncio.Lock()
+        return self.keys[key]
+
+class KeyedScope(MutableMapping):
+    """
+    Mutable view of a scope, of which only some keys are locked.
+    Locked keys are edited on private copies, which replace the live records when
+    the view exits. Other keys are read-only
+    """
+
+    _missing = object()
+
+    def __init__(self, view, scope, keys):
+        self._view = view
+        self._scope = scope
+        self._keys = keys
+        self.reset()
+
+    def reset(self):
+        """
+        Discards changes to the locked keys
+        """
+        live = DATABASE['data'][self._scope]
+        self._records = {
+            key: copy.deepcopy(live[key]) if key in live else self._missing
+            for key in self._keys
+        }
+
+    def install(self):
+        """
+        Called internally. Replaces the live records of the locked keys
+        """
+        live = DATABASE['data'][self._scope]
+        for key, value in self._records.items():
+            if value is self._missing:
+                live.pop(key, None)
+            else:
+                live[key] = value
+
+    def _check(self, key):
+        if not (self._view._entered and key in self._records):
+            raise TypeError("Key {} of scope {} is not locked by this view".format(key, self._scope))
+        self._view._touched.add(self._scope)
+
+    def __getitem__(self, key):
+        if key in self._records and self._view._entered:
+            if self._records[key] is self._missing:
+                raise KeyError(key)
+            if isinstance(self._records[key], (dict, list)):
+                self._view._touched.add(self._scope)
+            return self._records[key]
+        return freeze(self._scope, DATABASE['data'][self._scope][key])
+
+    def __setitem__(self, key, value):
+        self._check(key)
+        if isinstance(value, (FrozenDict, FrozenList)):
+            raise TypeError("Frozen")
+        self._records[key] = value
+
+    def __delitem__(self, key):
+        self._check(key)
+        if self._records[key] is self._missing:
+            raise KeyError(key)
+        self._records[key] = self._missing
+
+    def __contains__(self, key):
+        if key in self._records:
+            return self._records[key] is not self._missing
+        return key in DATABASE['data'][self._scope]
+
+    def __iter__(self):
+        for key in DATABASE['data'][self._scope]:
+            if key not in self._records:
+                yield key
+        for key, value in self._records.items():
+            if value is not self._missing:
+                yield key
+
+    def __len__(self):
+        return sum(1 for _ in self)
+
+    def __repr__(self):
+        return repr({key: self[key] for key in self})
+
+def configure_database(provider='pickle', path=None, write_behind=False, flush_interval=5, flush_threshold=16):
+    """
+    Selects the storage provider used by DBView.
+    Must be called before the database is first loaded.
+    If write_behind is True, committed scopes are batched and written by a
+    background task every flush_interval seconds, or as soon as flush_threshold
+    scopes are waiting to be written
+    """
+    if DATABASE['data'] is not None:
+        raise RuntimeError("Cannot change database provider after the database has been loaded")
+    if DATABASE['provider'] is not None:
+        DATABASE['provider'].close()
+    DATABASE['provider'] = get_provider(provider, path, legacy_path=DB_PATH)
+    DATABASE['write_behind'] = (flush_interval, flush_threshold) if write_behind else None
+
+def get_database_provider():
+    if DATABASE['provider'] is None:
+        DATABASE['provider'] = get_provider(legacy_path=DB_PATH)
+    return DATABASE['provider']
+
+async def _in_database_thread(func, *args):
+    """
+    Runs blocking database work on the database thread, so that disk I/O
+    and (de)serialization do not block the event loop.
+    There is a single database thread, so work runs in the order it was submitted
+    """
+    if DATABASE['executor'] is None:
+        DATABASE['executor'] = ThreadPoolExecutor(max_workers=1, thread_name_prefix='beymax-db')
+    return await asyncio.get_running_loop().run_in_executor(
+        DATABASE['executor'],
+        partial(func, *args)
+    )
+
+def _digest(payload):
+    return hashlib.blake2b(payload, digest_size=16).digest()
+
+def _read_database():
+    payloads = get_database_provider().load()
+    DATABASE['digests'] = {
+        scope: _digest(payload)
+        for scope, payload in payloads.items()
+    }
+    return {
+        scope: pickle.loads(payload)
+        for scope, payload in payloads.items()
+    }
+
+class _ScopePickler(pickle.Pickler):
+    """
+    Pickles a scope, noting whether it holds any frozen proxies
+    """
+
+    def __init__(self, file):
+        super().__init__(file)
+        self.frozen = False
+
+    def reducer_override(self, obj):
+        # Only called for non-builtin types, so this does not slow down plain data
+        if isinstance(obj, (FrozenDict, FrozenList)):
+            self.frozen = True
+        return NotImplemented
+
+def _serialize_changes(values):
+    """
+    Serializes the provided scope -> value pairs. Returns the payloads and
+    digests of scopes which differ from their last committed state, and
+    unfrozen copies of any scopes which hold frozen proxies
+    """
+    payloads = {}
+    digests = {}
+    frozen = {}
+    for scope, value in values.items():
+        buffer = io.BytesIO()
+        pickler = _ScopePickler(buffer)
+        pickler.dump(value)
+        payload = buffer.getvalue()
+        if pickler.frozen:
+            # Proxies are saved as plain copies, so load one to replace them in memory
+            frozen[scope] = pickle.loads(payload)
+        digest = _digest(payload)
+        if DATABASE['digests'].get(scope) != digest:
+            payloads[scope] = payload
+            digests[scope] = digest
+        else:
+            DATABASE['stats']['unchanged'] += 1
+    return payloads, digests, frozen
+
+def _commit_changes(values, write=True):
+    """
+    Commits any of the provided scope -> value pairs which have changed.
+    If write is False, the changed payloads are returned to be written later.
+    Returns the changed payloads, and unfrozen copies of any scopes which hold
+    frozen proxies
+    """
+    payloads, digests, frozen = _serialize_changes(values)
+    if write and len(payloads):
+        _write_payloads(payloads)
+    # In write-behind mode, pending payloads count as committed. If the write
+    # fails, they are kept pending until a later flush succeeds
+    DATABASE['digests'].update(digests)
+    return payloads, frozen
+
+def _write_payloads(payloads):
+    """
+    Writes scope -> payload pairs to the storage provider.
+    Scopes with a payload of None are deleted
+    """
+    start = time.monotonic()
+    saves = {scope: payload for scope, payload in payloads.items() if payload is not None}
+    if len(saves):
+        get_database_provider().save_scopes(saves)
+    for scope, payload in payloads.items():
+        if payload is None:
+            get_database_provider().delete_scope(scope)
+    elapsed = time.monotonic() - start
+    DATABASE['stats']['flushes'] += 1
+    DATABASE['stats']['scopes'] += len(payloads)
+    DATABASE['stats']['bytes'] += sum(len(payload) for payload in saves.values())
+    DATABASE['stats']['time'] += elapsed
+    DATABASE['stats']['last'] = elapsed
+    DATABASE['stats']['max'] = max(DATABASE['stats']['max'], elapsed)
+
+def _unwritten_payload(scope):
+    """
+    Checks for committed changes to a scope which have not been written yet.
+    Returns (True, payload) if there are any (payload is None if the scope was deleted).
+    Otherwise, returns (False, None)
+    """
+    for table in (DATABASE['pending'], DATABASE['flushing']):
+        if scope in table:
+            return True, table[scope]
+    return False, None
+
+def _load_committed(scope):
+    """
+    Returns the most recently committed value of a scope, including changes
+    which are still waiting to be written.
+    Raises a KeyError if the scope has not been saved
+    """
+    unwritten, payload = _unwritten_payload(scope)
+    if not unwritten:
+        payload = get_database_provider().load_scope(scope)
+    if payload is None:
+        raise KeyError(scope)
+    return pickle.loads(payload)
+
+async def _async_load_committed(scope):
+    """
+    Coroutine version of _load_committed which reads from the database thread
+    """
+    unwritten, payload = _unwritten_payload(scope)
+    if not unwritten:
+        payload = await _in_database_thread(get_database_provider().load_scope, scope)
+    if payload is None:
+        raise KeyError(scope)
+    return await _in_database_thread(pickle.loads, payload)
+
+@atexit.register
+def _write_pending_at_exit():
+    if len(DATABASE['pending']):
+        print("Writing", len(DATABASE['pending']), "pending database scopes")
+        _write_payloads(DATABASE['pending'])
+        DATABASE['pending'] = {}
+
+async def _database_writer():
+    """
+    Background task which flushes pending scopes in write-behind mode
+    """
+    interval, _ = DATABASE['write_behind']
+    while True:
+        try:
+            await asyncio.wait_for(DATABASE['flush_event'].wait(), interval)
+        except asyncio.TimeoutError:
+            pass
+        DATABASE['flush_event'].clear()
+        try:
+            await DBView.flush()
+        except:
+            traceback.print_exc()
+            print("Unable to flush database. Changes will be retried")
+
 class DBView(object):
     """
-    A view to the centralized database file.
+    A view to the centralized database.
 
     Allows read-access to full database. Write-access is protected through
-    asyncronous context management
+    asyncronous context management. Each scope is persisted independently,
+    so committing a view only rewrites the scopes it holds.
+    Views may also hold individual keys within a scope, so that views of
+    different keys in the same scope do not wait for each other
     """
 
     @staticmethod
     def serializable(value):
-        if isinstance(value, FrozenDict):
+        if isinstance(value, (FrozenDict, KeyedScope)):
             return {
                 k: DBView.serializable(v) for k,v in value.items()
             }
@@ -107,14 +506,20 @@ class DBView(object):
         """
         Used for accessing a partial view of the database in read-only mode.
         Useful for database checks outside of coroutines.
+        Values are read-only proxies to the live database, not copies, so the
+        cost of a read depends only on the keys accessed.
         Does not guarantee consistency
         """
-        if read_persistent and os.path.isfile('BEYMAX_FIXME_DB_PKL_PATH') and os.path.getsize('BEYMAX_FIXME_DB_PKL_PATH') > 0:
-            with open('BEYMAX_FIXME_DB_PKL_PATH', 'rb') as r:
-                fallback = pickle.load(r)
-        else:
-            fallback = {}
         view = DBView()
+        fallback = {}
+        if read_persistent:
+            # The persistent copy is only used for scopes missing from memory
+            for scope in scopes:
+                if scope not in view:
+                    try:
+                        fallback[scope] = _load_committed(scope)
+                    except KeyError:
+                        pass
         return FrozenDict(
             'root',
             {
@@ -137,86 +542,229 @@ class DBView(object):
             for key, value in data.items():
                 db[key] = value
 
+    @staticmethod
+    async def flush():
+        """
+        Immediately writes any changes which are waiting to be written.
+        Only has an effect in write-behind mode
+        """
+        if not len(DATABASE['pending']):
+            return
+        pending = DATABASE['pending']
+        DATABASE['pending'] = {}
+        # Keep the payloads visible to readers until the write completes
+        DATABASE['flushing'].update(pending)
+        try:
+            await _in_database_thread(_write_payloads, pending)
+        except:
+            # Anything committed since we started takes priority
+            DATABASE['pending'] = {**pending, **DATABASE['pending']}
+            raise
+        finally:
+            for scope, payload in pending.items():
+                if scope in DATABASE['flushing'] and DATABASE['flushing'][scope] is payload:
+                    del DATABASE['flushing'][scope]
+
+    @staticmethod
+    async def compact(threshold=0):
+        """
+        Asks the storage provider to compact its journal, if it has grown past
+        threshold bytes. Returns True if the database was compacted
+        """
+        return await _in_database_thread(get_database_provider().compact, threshold)
+
+    @staticmethod
+    def stats():
+        """
+        Returns a dictionary of database write statistics.
+        Times are in seconds
+        """
+        return {
+            **DATABASE['stats'],
+            'pending': len(DATABASE['pending']),
+        }
+
+    @staticmethod
+    def _load():
+        """
+        Called internally. Loads the database into memory, if necessary.
+        This blocks the event loop, so coroutines should use _async_load
+        """
+        if DATABASE['data'] is None:
+            DATABASE['data'] = _read_database()
+
+    @staticmethod
+    async def _async_load():
+        """
+        Called internally. Loads the database into memory on the database thread,
+        if necessary
+        """
+        if DATABASE['data'] is None:
+            async with DATABASE['lock']:
+                if DATABASE['data'] is None:
+                    data = await _in_database_thread(_read_database)
+                    # A synchronous _load may have run while waiting, and its
+                    # data may already have been changed
+                    if DATABASE['data'] is None:
+                        DATABASE['data'] = data
+
     def __init__(self, *scopes, _add_scope_to_defaults=True, **defaults):
-        self.scopes = sorted(set(scopes)) # Enforce lock ordering
+        """
+        Scopes may be given by name, to hold the whole scope, or as a tuple
+        of (scope, *keys) to only hold those keys within the scope.
+        For example, DBView(('players', user.id)) only allows changes to that user's
+        record, so views of other players' records do not have to wait
+        """
+        self.scopes = sorted({scope for scope in scopes if isinstance(scope, str)}) # Enforce lock ordering
+        self.keys = {}
+        for spec in scopes:
+            if not isinstance(spec, str) and spec[0] not in self.scopes:
+                self.keys.setdefault(spec[0], set()).update(spec[1:])
+        # Keys can be any type, so order them by their repr
+        self.keys = {
+            scope: sorted(keys, key=repr)
+            for scope, keys in self.keys.items()
+        }
         if _add_scope_to_defaults:
             self._defaults = {
-                **{scope: {} for scope in scopes},
+                **{scope: {} for scope in self.scopes},
+                **{scope: {} for scope in self.keys},
                 **{k:v for k,v in defaults.items()}
             }
         else:
             self._defaults = {k:v for k,v in defaults.items()}
         self._entered = False
-        self._dirty = False
+        self._touched = set() # Scopes which may have been modified
+        self._keyed = {} # scope -> KeyedScope for scopes where only some keys are held
+        self._locks = []
 
     async def __aenter__(self):
-        if len(self._defaults):
+        await self._async_load()
+        missing = [key for key in self._defaults if key not in DATABASE['data']]
+        if len(missing):
             # If we provided defaults, quickly update them
-            async with DBView(*self._defaults, _add_scope_to_defaults=False) as db:
-                for key, value in self._defaults.items():
+            async with self.__class__(*missing, _add_scope_to_defaults=False) as db:
+                for key in missing:
                     if key not in db:
-                        db[key] = value
-        async with DATABASE['lock']:
-            if DATABASE['data'] is None:
-                if os.path.isfile('BEYMAX_FIXME_DB_PKL_PATH') and os.path.getsize('BEYMAX_FIXME_DB_PKL_PATH') > 0:
-                    with open('BEYMAX_FIXME_DB_PKL_PATH', 'rb') as r:
-                        DATABASE['data'] = pickle.load(r)
-                else:
-                    DATABASE['data'] = {}
-            for scope in self.scopes:
-                if scope not in DATABASE['scope_locks']:
-                    DATABASE['scope_locks'][scope] = asyncio.Lock()
-                await DATABASE['scope_locks'][scope].acquire()
-            self._entered = True
+                        db[key] = self._defaults[key]
+        for scope in self.keys:
+            if not isinstance(DATABASE['data'][scope], dict):
+                raise TypeError("Keys can only be held in dictionary scopes: {}".format(scope))
+        for scope in [*self.scopes, *self.keys]:
+            if scope not in DATABASE['scope_locks']:
+                DATABASE['scope_locks'][scope] = ScopeLock()
+        # Sorted acquisition order prevents deadlocks between views.
+        # Each scope comes before its keys
+        try:
+            for scope in sorted([*self.scopes, *self.keys]):
+                lock = DATABASE['scope_locks'][scope]
+                await lock.acquire(shared=scope in self.keys)
+                self._locks.append((scope, None))
+                for key in self.keys.get(scope, []):
+                    await lock.key_lock(key).acquire()
+                    self._locks.append((scope, key))
+        except:
+            await self._release()
+            raise
+        for scope, keys in self.keys.items():
+            self._keyed[scope] = KeyedScope(self, scope, keys)
+        self._entered = True
         return self
 
+    async def _release(self):
+        """
+        Called internally. Releases held locks in reverse order
+        """
+        for scope, key in reversed(self._locks):
+            if key is None:
+                await DATABASE['scope_locks'][scope].release(shared=scope in self.keys)
+            else:
+                DATABASE['scope_locks'][scope].keys[key].release()
+        self._locks = []
+
     async def __aexit__(self, exc_type, exc_val, tb):
-        if self._dirty and (exc_type is not None or exc_val is not None or tb is not None):
+        if len(self._touched) and (exc_type is not None or exc_val is not None or tb is not None):
             traceback.print_exc()
             print("Database connection exiting uncleanly. Aborting changes")
-            await self.abort() # sets dirty to false so all that happens afterwards is __aexit__ releases locks
-        async with DATABASE['lock']:
+            await self.abort() # clears touched scopes so all that happens afterwards is __aexit__ releases locks
+        try:
             self._entered = False
-            if self._dirty:
-                # Load current state from file
+            if len(self._touched):
+                # Changes to held keys are made on copies until now
+                for scope in self._touched:
+                    if scope in self._keyed:
+                        self._keyed[scope].install()
                 # We should only save scopes we have access to
                 # even if other scopes have changed
                 # This avoids accidentally leaking changes that will later be aborted
                 # by another view
-                if os.path.isfile('BEYMAX_FIXME_DB_PKL_PATH') and os.path.getsize('BEYMAX_FIXME_DB_PKL_PATH') > 0:
-                    with open('BEYMAX_FIXME_DB_PKL_PATH', 'rb') as r:
-                        prev = pickle.load(r)
-                else:
-                    prev = {}
-                with open('BEYMAX_FIXME_DB_PKL_PATH', 'wb') as w:
-                    prev.update({
-                        key: DATABASE['data'][key]
-                        for key in self.scopes
-                        if key in DATABASE['data']
-                    })
-                    pickle.dump(prev, w)
-            # Release locks in reverse order
-            for scope in reversed(self.scopes):
-                DATABASE['scope_locks'][scope].release()
+                await self._persist()
+                self._touched = set()
+        finally:
+            self._keyed = {}
+            await self._release()
+
+    async def _persist(self):
+        """
+        Called internally (with scope locks held) to save the scopes
+        touched by this view. Scopes which were only read are not saved
+        """
+        values = {
+            # Other views may replace records in scopes where we only hold some keys,
+            # so save a copy of the scope as it is now
+            key: dict(DATABASE['data'][key]) if key in self._keyed else DATABASE['data'][key]
+            for key in self._touched
+            if key in DATABASE['data']
+        }
+        if DATABASE['write_behind'] is None:
+            payloads, frozen = await _in_database_thread(_commit_changes, values)
+        else:
+            payloads, frozen = await _in_database_thread(_commit_changes, values, False)
+            if len(payloads):
+                DATABASE['pending'].update(payloads)
+                self._wake_writer()
+        for key, value in frozen.items():
+            # Frozen proxies alias live data (possibly in other scopes), so replace
+            # them with the copies which were saved
+            if key in self._keyed:
+                live = DATABASE['data'][key]
+                for record in self._keyed[key]._keys:
+                    if record in value:
+                        live[record] = value[record]
+            else:
+                DATABASE['data'][key] = value
+
+    @staticmethod
+    def _wake_writer():
+        """
+        Called internally. Starts the write-behind task, if necessary,
+        and wakes it early if enough scopes are waiting to be written
+        """
+        if DATABASE['writer'] is None or DATABASE['writer'].done():
+            DATABASE['flush_event'] = asyncio.Event()
+            DATABASE['writer'] = asyncio.ensure_future(_database_writer())
+        if len(DATABASE['pending']) >= DATABASE['write_behind'][1]:
+            DATABASE['flush_event'].set()
 
     def __getitem__(self, key):
+        if DATABASE['data'] is None:
+            self._load()
         if key not in DATABASE['data']:
             raise KeyError(key)
         if key in self.scopes and not key in self:
             raise KeyError("Value Deleted")
+        if self._entered and key in self._keyed:
+            return self._keyed[key]
         val = DATABASE['data'][key]
         if not (self._entered and key in self.scopes):
             # If we're not scoped, ensure that dicts or lists are frozen
-            if isinstance(val, dict):
-                return FrozenDict(key, val)
-            elif isinstance(val, list):
-                return FrozenList(key, val)
+            return freeze(key, val)
         # Otherwise return val because either it's a singleton object or
         # we're scoped and it's allowed to be mutable
         if self._entered and key in self.scopes and isinstance(val, (dict, list)):
-            # If we're scoped and this is a mutable object, just set the state
-            # to dirty
-            self._dirty = True
+            # If we're scoped and this is a mutable object, it may be modified.
+            # Whether it actually changed is checked when the view exits
+            self._touched.add(key)
         return val
 
     def __setitem__(self, key, value):
@@ -224,7 +772,7 @@ class DBView(object):
             raise TypeError("Scope {} is currently frozen".format(key))
         if isinstance(value, (FrozenDict, FrozenList)):
             raise TypeError("Frozen")
-        self._dirty = True
+        self._touched.add(key)
         DATABASE['data'][key] = value
         # if key == 'players':
         #     import pdb; pdb.set_trace()
@@ -233,23 +781,32 @@ class DBView(object):
         if not (self._entered and key in self.scopes):
             raise TypeError("Scope {} is currently frozen".format(key))
 
-        async with DATABASE['lock']:
-            del DATABASE['data'][key]
-            if os.path.isfile('BEYMAX_FIXME_DB_PKL_PATH') and os.path.getsize('BEYMAX_FIXME_DB_PKL_PATH') > 0:
-                with open('BEYMAX_FIXME_DB_PKL_PATH', 'rb') as r:
-                    prev = pickle.load(r)
-            else:
-                prev = {}
-            with open('BEYMAX_FIXME_DB_PKL_PATH', 'wb') as w:
-                del prev[key]
-                pickle.dump(prev, w)
-            self.scopes.remove(key)
-            self._dirty = True
+        del DATABASE['data'][key]
+        self.scopes.remove(key)
+        self._touched.discard(key)
+        # Forget the committed digest, so the scope is always saved if it is recreated
+        DATABASE['digests'].pop(key, None)
+        await self._delete(key)
+
+    async def _delete(self, key):
+        """
+        Called internally (with the scope lock held) to remove a scope
+        from persistent storage
+        """
+        if DATABASE['write_behind'] is None:
+            await _in_database_thread(_write_payloads, {key: None})
+        else:
+            DATABASE['pending'][key] = None
+            self._wake_writer()
 
     def __contains__(self, key):
+        if DATABASE['data'] is None:
+            self._load()
         return key in DATABASE['data']
 
     def __iter__(self):
+        if DATABASE['data'] is None:
+            self._load()
         yield from DATABASE['data']
 
     def __repr__(self):
@@ -259,57 +816,34 @@ class DBView(object):
         """
         Abort any pending changes
         """
-        async with DATABASE['lock']:
-            self._entered = False
-            if self._dirty:
-                # Reload our scopes from disk
-                # Remember, we have exclusive write access so we're only discarding
-                # our own changes
-                if os.path.isfile('BEYMAX_FIXME_DB_PKL_PATH') and os.path.getsize('BEYMAX_FIXME_DB_PKL_PATH') > 0:
-                    with open('BEYMAX_FIXME_DB_PKL_PATH', 'rb') as r:
-                        prev = pickle.load(r)
-                else:
-                    prev = {}
-                for key, value in prev.items():
-                    DATABASE['data'][key] = value
-            self._dirty = False
-            self._entered = True
+        self._entered = False
+        if len(self._touched):
+            # Reload our scopes from their last committed state
+            # Remember, we have exclusive write access to these scopes,
+            # so we're only discarding our own changes
+            for key in self._touched:
+                if key in self._keyed:
+                    # Held keys were only changed on copies
+                    self._keyed[key].reset()
+                    continue
+                try:
+                    DATABASE['data'][key] = await _async_load_committed(key)
+                except KeyError:
+                    if key in DATABASE['data']:
+                        del DATABASE['data'][key]
+        self._touched = set()
+        self._entered = True
 
 class VolatileDBView(DBView):
-    async def __aenter__(self):
-        if len(self._defaults):
-            # If we provided defaults, quickly update them (volatile)
-            async with VolatileDBView(*self._defaults, _add_scope_to_defaults=False) as db:
-                for key, value in self._defaults.items():
-                    if key not in db:
-                        db[key] = value
-        async with DATABASE['lock']:
-            if DATABASE['data'] is None:
-                if os.path.isfile('BEYMAX_FIXME_DB_PKL_PATH') and os.path.getsize('BEYMAX_FIXME_DB_PKL_PATH') > 0:
-                    with open('BEYMAX_FIXME_DB_PKL_PATH', 'rb') as r:
-                        DATABASE['data'] = pickle.load(r)
-                else:
-                    DATABASE['data'] = {}
-            for scope in self.scopes:
-                if scope not in DATABASE['scope_locks']:
-                    DATABASE['scope_locks'][scope] = asyncio.Lock()
-                await DATABASE['scope_locks'][scope].acquire()
-            self._entered = True
-        return self
-
-    async def __aexit__(self, exc_type, exc_val, tb):
-        if self._dirty and (exc_type is not None or exc_val is not None or tb is not None):
-            traceback.print_exc()
-            print("Database connection exiting uncleanly. Aborting changes")
-            await self.abort() # sets dirty to false so all that happens afterwards is __aexit__ releases locks
-        async with DATABASE['lock']:
-            self._entered = False
-            # Do not save changes to disk
-            # Release locks in reverse order
-            for scope in reversed(self.scopes):
-                DATABASE['scope_locks'][scope].release()
+    async def _persist(self):
+        # Do not save changes to disk
+        pass
 
 class Interpolator(dict):
+    """
+    Default substitutions for messages sent to a channel.
+    Every key starts with $, so content without a $ never needs interpolation
+    """
     def __init__(self, bot, channel):
         NAME = bot.config_get(
             'name',
@@ -347,12 +881,81 @@ class Interpolator(dict):
             '$!': bot.command_prefix
         })
 
+@lru_cache(maxsize=64)
+def _interpolation_pattern(keys):
+    # Longest keys first, so that a key is never cut short by another key it starts with
+    return re.compile('|'.join(re.escape(key) for key in sorted(keys, key=len, reverse=True)))
+
+def interpolate(content, substitutions):
+    """
+    Replaces each occurrence of a key of substitutions in the content with its value.
+    Content is scanned in a single pass, so substituted values are not themselves interpolated
+    """
+    if not len(substitutions):
+        return content
+    return _interpolation_pattern(frozenset(substitutions)).sub(
+        lambda match: substitutions[match.group(0)],
+        content
+    )
 
 def sanitize(string, illegal, replacement=''):
     for char in illegal:
         string = string.replace(char, replacement)
     return string
 
+CHUNK_DELIMITERS = ('\n', '. ', ' ')
+
+def chunk_message(content, delim='\n', quote='', target=1024, limit=2000):
+    """
+    Splits message content into chunks for sending.
+    Pieces separated by the delimiter are grouped until a chunk reaches the target length.
+    Pieces too long to fit in a chunk are split by the next smaller delimiter
+    (newlines, then sentences, then spaces), and as a last resort are cut at the limit.
+    Each chunk is wrapped in the quote string, and is at most limit characters long
+    (including the quotes). Runs in linear time.
+    Returns a list of chunks
+    """
+    limit -= 2 * len(quote)
+    if limit <= 0:
+        raise ValueError("Quote is too long to fit in a message")
+    target = min(target, limit)
+    levels = [delim] + [
+        fallback for fallback in CHUNK_DELIMITERS[
+            CHUNK_DELIMITERS.index(delim) + 1 if delim in CHUNK_DELIMITERS else 0:
+        ]
+        if fallback != delim
+    ]
+    chunks = []
+
+    def split(text, level):
+        if level >= len(levels):
+            # No delimiters left. Hard cut the text
+            chunks.extend(text[i:i+limit] for i in range(0, len(text), limit))
+            return
+        delimiter = levels[level]
+        parts = []
+        size = 0 # length of delimiter.join(parts)
+        for piece in text.split(delimiter):
+            if len(piece) > limit:
+                if len(parts):
+                    chunks.append(delimiter.join(parts))
+                    parts, size = [], 0
+                split(piece, level + 1)
+                continue
+            if len(parts) and size + len(delimiter) + len(piece) > limit:
+                chunks.append(delimiter.join(parts))
+                parts, size = [], 0
+            size += len(piece) + (len(delimiter) if len(parts) else 0)
+            parts.append(piece)
+            if size >= target:
+                chunks.append(delimiter.join(parts))
+                parts, size = [], 0
+        if len(parts):
+            chunks.append(delimiter.join(parts))
+
+    split(content, 0)
+    return [quote + chunk + quote for chunk in chunks if len(chunk)]
+
 def getname(user):
     if user is None:
         return 'someone'